@@ -1,18 +1,147 @@
+import csv
+import os
+import pickle
 import random
-import matplotlib.pyplot as plt
+import sys
+import numpy as np
+from bisect import bisect_right
+from itertools import accumulate
+from multiprocessing import Pool
 from typing import List, Tuple
 import time
 
+SELECTION_METHODS = {
+    'roulette': 'roulette_wheel_selection',
+    'tournament': 'tournament_selection',
+    'rank': 'rank_selection',
+}
+
+def pyplot(headless: bool = False):
+    # matplotlib is only imported once something is actually plotted, so pool workers and
+    # runs that never plot don't pay for it. headless picks the Agg backend, no display needed
+    import matplotlib
+    if headless and 'matplotlib.pyplot' not in sys.modules:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def show_or_save(plt, save_path=None):
+    if save_path is None:
+        plt.show()
+    else:
+        # .png, .svg etc, matplotlib picks the format from the extension
+        plt.savefig(save_path, dpi=150, bbox_inches='tight')
+        plt.close()
+
+class GenerationProfiler:
+    """Per-phase wall time and event counters for the generation loop. Each lap() charges
+    the time since the previous one to a phase, so the phases add up to the whole generation."""
+
+    enabled = True
+    phases = ('fitness', 'selection', 'crossover', 'mutation', 'bookkeeping')
+
+    def __init__(self):
+        self.totals = dict.fromkeys(self.phases, 0.0)
+        self.last = dict.fromkeys(self.phases, 0.0)
+        self.counts = {}
+        self.generations = 0
+        self.mark = 0.0
+
+    def start(self):
+        self.last = dict.fromkeys(self.phases, 0.0)
+        self.mark = time.perf_counter()
+
+    def lap(self, phase: str):
+        now = time.perf_counter()
+        self.last[phase] += now - self.mark
+        self.mark = now
+
+    def count(self, name: str, n: int):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def end_generation(self):
+        for phase, seconds in self.last.items():
+            self.totals[phase] += seconds
+        self.generations += 1
+
+    def merge(self, other: 'GenerationProfiler'):
+        # island profilers are folded into the parent's, generations become island-generations
+        for phase, seconds in other.totals.items():
+            self.totals[phase] += seconds
+        for name, n in other.counts.items():
+            self.count(name, n)
+        self.generations += other.generations
+
+    def report(self) -> str:
+        total = sum(self.totals.values())
+        per_gen = 1000 * total / max(self.generations, 1)
+        lines = [f'{self.generations} generations in {total:.3f}s ({per_gen:.3f} ms/gen)',
+                 f"{'phase':14}{'total s':>10}{'ms/gen':>10}{'share':>8}"]
+        for phase in self.phases:
+            seconds = self.totals[phase]
+            share = seconds / total if total else 0.0
+            lines.append(f'{phase:14}{seconds:10.3f}{1000 * seconds / max(self.generations, 1):10.3f}{share:8.1%}')
+        for name, n in self.counts.items():
+            rate = f' ({n / total:,.0f}/s)' if total else ''
+            lines.append(f'{name:14}{n:>10,}{rate}')
+        return '\n'.join(lines)
+
+class NullProfiler(GenerationProfiler):
+    # stands in when profiling is off so the loop doesn't branch on every phase
+    enabled = False
+
+    def start(self):
+        pass
+
+    def lap(self, phase: str):
+        pass
+
+    def count(self, name: str, n: int):
+        pass
+
+    def end_generation(self):
+        pass
+
+NULL_PROFILER = NullProfiler()
+
 class GeneticAlgorithm:
-    def __init__(self, pop_size: int = 50, gens: int = 100, mut_rate: float = 0.1):
+    # attributes that change as the GA runs, saved in checkpoints
+    checkpoint_attrs = ('rng', 'best', 'best_score', 'best_history', 'avg_history', 'history_bytes')
+    history_header = ('generation', 'best', 'average')
+
+    def __init__(self, pop_size: int = 50, gens: int = 100, mut_rate: float = 0.1, seed=None,
+                 selection: str = 'roulette', tournament_size: int = 3, checkpoint_path: str = None,
+                 checkpoint_every: int = 100, history_path: str = None, profile: bool = False,
+                 callbacks=None):
+        if selection not in SELECTION_METHODS:
+            raise ValueError(f"Unknown selection '{selection}', choose from {list(SELECTION_METHODS)}")
         self.pop_size = pop_size
         self.gens = gens
         self.mut_rate = mut_rate
+        self.seed = seed
+        self.selection = selection
+        self.tournament_size = tournament_size
+        self.rng = random.Random(seed)
         self.best_history = []
         self.avg_history = []
+        self.best = None
+        self.best_score = float('-inf')
+
+        # periodic pickle of the run state, and optional csv the per-generation stats go to
+        # instead of best_history/avg_history
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.history_path = history_path
+        self.history_buffer = []
+        self.history_bytes = 0
+
+        # opt-in phase timers, and hooks called as hook(ga, stats) after every generation
+        self.profiler = GenerationProfiler() if profile else None
+        self.callbacks = list(callbacks or [])
+        self.mutations_applied = 0
 
     def make_random(self) -> List[int]:
-        return [random.randint(0, 1) for _ in range(32)]
+        return [self.rng.randint(0, 1) for _ in range(32)]
    
     def calculate_fitness(self, bits: List[int]) -> int:
         blocks = [bits[i:i+8] for i in range(0, 32, 8)]
@@ -20,22 +149,38 @@ class GeneticAlgorithm:
         green = sum(blocks[1]) + sum(blocks[2])
         return blue - green
    
-    def roulette_wheel_selection(self, pop: List[List[int]], scores: List[int]) -> List[int]:
-        total = sum(scores)
+    def select_parents(self, pop: List[List[int]], scores: List[int], n: int) -> List[List[int]]:
+        # all n parents for a generation are drawn in one call with the chosen strategy
+        return getattr(self, SELECTION_METHODS[self.selection])(pop, scores, n)
+
+    def roulette_wheel_selection(self, pop: List[List[int]], scores: List[int], n: int) -> List[List[int]]:
+        # cumulative wheel is built once, then each spin is a binary search. scores can be
+        # negative, so the spin lands on the first running total above it: that is a search
+        # over the running max of the totals, which picks what a linear scan of the wheel did
+        cum = list(accumulate(scores))
+        total = cum[-1]
         if total == 0:
-            return random.choice(pop)
-       
-        rand = random.uniform(0, total)
-        current = 0
-       
-        for i in range(len(pop)):
-            current += scores[i]
-            if current > rand:
-                return pop[i]
-        return pop[-1]
+            return [self.rng.choice(pop) for _ in range(n)]
+
+        peaks = list(accumulate(cum, max))
+        last = len(pop) - 1
+        return [pop[min(bisect_right(peaks, self.rng.uniform(0, total)), last)] for _ in range(n)]
+
+    def tournament_selection(self, pop: List[List[int]], scores: List[int], n: int) -> List[List[int]]:
+        contenders = range(len(pop))
+        return [pop[max(self.rng.choices(contenders, k=self.tournament_size), key=scores.__getitem__)]
+                for _ in range(n)]
+
+    def rank_selection(self, pop: List[List[int]], scores: List[int], n: int) -> List[List[int]]:
+        # wheel slices are proportional to rank (worst = 1) instead of raw score
+        order = sorted(range(len(pop)), key=scores.__getitem__)
+        cum = list(accumulate(range(1, len(pop) + 1)))
+        total = cum[-1]
+        last = len(pop) - 1
+        return [pop[order[min(bisect_right(cum, self.rng.uniform(0, total)), last)]] for _ in range(n)]
    
     def crossover(self, p1: List[int], p2: List[int]) -> Tuple[List[int], List[int]]:
-        point = random.randint(0, 31)
+        point = self.rng.randint(0, 31)
         c1 = p1[:point] + p2[point:]
         c2 = p2[:point] + p1[point:]
         return c1, c2
@@ -43,11 +188,71 @@ class GeneticAlgorithm:
     def mutate(self, bits: List[int]) -> List[int]:
         new_bits = bits.copy()
         for i in range(len(bits)):
-            if random.random() < self.mut_rate:
+            if self.rng.random() < self.mut_rate:
                 new_bits[i] = 1 - bits[i]
+                self.mutations_applied += 1
         return new_bits
    
-    def visualize_results(self):
+    def record_generation(self, gen: int, best: int, avg: float):
+        if self.history_path is None:
+            self.best_history.append(best)
+            self.avg_history.append(avg)
+            return
+
+        self.history_buffer.append((gen, best, avg))
+        if len(self.history_buffer) >= 1000:
+            self.flush_history()
+
+    def flush_history(self):
+        if self.history_path is None or not self.history_buffer:
+            return
+        with open(self.history_path, 'a', newline='') as f:
+            csv.writer(f).writerows(self.history_buffer)
+            self.history_bytes = f.tell()
+        self.history_buffer = []
+
+    def reset_history_file(self):
+        with open(self.history_path, 'w', newline='') as f:
+            csv.writer(f).writerow(self.history_header)
+            self.history_bytes = f.tell()
+        self.history_buffer = []
+
+    def load_history(self):
+        # reads a streamed history file back into best_history/avg_history for plotting
+        self.flush_history()
+        with open(self.history_path, newline='') as f:
+            rows = list(csv.reader(f))[1:]
+        self.best_history = [int(row[1]) for row in rows]
+        self.avg_history = [float(row[2]) for row in rows]
+
+    def save_checkpoint(self, pop, next_gen: int):
+        # history is flushed first so the file never lags behind the checkpoint
+        self.flush_history()
+        state = {name: getattr(self, name) for name in self.checkpoint_attrs}
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'gen': next_gen, 'pop': pop, 'state': state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def load_checkpoint(self):
+        with open(self.checkpoint_path, 'rb') as f:
+            checkpoint = pickle.load(f)
+        for name, value in checkpoint['state'].items():
+            setattr(self, name, value)
+        self.history_buffer = []
+
+        # drop any rows written after the checkpoint so they aren't duplicated
+        if self.history_path is not None:
+            with open(self.history_path, 'r+b') as f:
+                f.truncate(self.history_bytes)
+        return checkpoint['pop'], checkpoint['gen']
+
+    def visualize_results(self, save_path=None):
+        if self.history_path is not None:
+            self.load_history()
+        plt = pyplot(headless=save_path is not None)
         plt.figure(figsize=(12, 6))
         plt.plot(self.best_history, label='Best Fitness')
         plt.plot(self.avg_history, label='Average Fitness')
@@ -56,7 +261,7 @@ class GeneticAlgorithm:
         plt.title('Fitness Evolution Over Generations')
         plt.legend()
         plt.grid(True)
-        plt.show()
+        show_or_save(plt, save_path)
 
     def print_block_analysis(self, bits: List[int]):
         blocks = [bits[i:i+8] for i in range(0, 32, 8)]
@@ -70,38 +275,266 @@ class GeneticAlgorithm:
         print(f"\nTotal blue ones: {sum(blocks[0]) + sum(blocks[3])}")
         print(f"Total green ones: {sum(blocks[1]) + sum(blocks[2])}")
 
-    def run(self, verbose: bool = True) -> Tuple[List[int], int]:
-        pop = [self.make_random() for _ in range(self.pop_size)]
-        best = None
-        best_score = float('-inf')
-        
-        for gen in range(self.gens):
+    def init_population(self) -> List[List[int]]:
+        return [self.make_random() for _ in range(self.pop_size)]
+
+    def rank_population(self, pop: List[List[int]]) -> List[List[int]]:
+        # fittest first, used to pick migrants and the individuals they replace
+        return sorted(pop, key=self.calculate_fitness, reverse=True)
+
+    def evolve(self, pop: List[List[int]], gens: int, start_gen: int = 0, verbose: bool = False) -> List[List[int]]:
+        prof = self.profiler or NULL_PROFILER
+        hooks = self.generation_hooks(verbose)
+        n_pairs = (self.pop_size + 1) // 2
+
+        for gen in range(start_gen, start_gen + gens):
+            prof.start()
+            mutations_before = self.mutations_applied
             scores = [self.calculate_fitness(p) for p in pop]
-            avg_fitness = sum(scores) / len(scores)
-            self.avg_history.append(avg_fitness)
-            
-            gen_best_score = max(scores)
-            self.best_history.append(gen_best_score)
+            prof.lap('fitness')
 
-            if gen_best_score > best_score:
-                best_score = gen_best_score
-                best = pop[scores.index(gen_best_score)]
+            parents = self.select_parents(pop, scores, 2 * n_pairs)
+            prof.lap('selection')
 
+            # crossover and mutation stay interleaved per pair so the random stream is unchanged
             new_pop = []
-            while len(new_pop) < self.pop_size:
-                p1 = self.roulette_wheel_selection(pop, scores)
-                p2 = self.roulette_wheel_selection(pop, scores)
+            for p1, p2 in zip(parents[:n_pairs], parents[n_pairs:]):
                 c1, c2 = self.crossover(p1, p2)
+                prof.lap('crossover')
                 c1 = self.mutate(c1)
                 c2 = self.mutate(c2)
                 new_pop.extend([c1, c2])
+                prof.lap('mutation')
 
+            avg_fitness = sum(scores) / len(scores)
+            gen_best_score = max(scores)
+            improved = gen_best_score > self.best_score
+            self.record_generation(gen, gen_best_score, avg_fitness)
+            if improved:
+                self.best_score = gen_best_score
+                self.best = pop[scores.index(gen_best_score)]
             pop = new_pop[:self.pop_size]
 
-            if verbose and gen % 10 == 0:
-                print(f"Generation {gen}: Current best = {best_score}")
+            if self.checkpoint_path and (gen + 1) % self.checkpoint_every == 0:
+                self.save_checkpoint(pop, gen + 1)
+            prof.lap('bookkeeping')
+            prof.count('evaluations', len(scores))
+            prof.count('selections', 2 * n_pairs)
+            prof.count('mutations', self.mutations_applied - mutations_before)
+            prof.end_generation()
+
+            if hooks:
+                self.call_hooks(hooks, gen, gen_best_score, avg_fitness, improved)
+
+        return pop
+
+    def generation_hooks(self, verbose: bool) -> list:
+        return self.callbacks + [type(self).log_progress] if verbose else list(self.callbacks)
+
+    def call_hooks(self, hooks: list, gen: int, best: int, avg: float, improved: bool):
+        stats = {'gen': gen, 'best': best, 'avg': avg, 'best_so_far': self.best_score, 'improved': improved}
+        if self.profiler is not None:
+            stats['times'] = dict(self.profiler.last)
+        for hook in hooks:
+            hook(self, stats)
+
+    def log_progress(self, stats: dict):
+        # default hook for verbose runs
+        if stats['gen'] % 10 == 0:
+            print(f"Generation {stats['gen']}: Current best = {stats['best_so_far']}")
+
+    def run(self, verbose: bool = True, resume: bool = False) -> Tuple[List[int], int]:
+        """Runs the GA. With resume=True and an existing checkpoint_path the run carries on
+        from the last checkpoint (population, RNG state, best so far and history)."""
+        if resume and self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            pop, start_gen = self.load_checkpoint()
+            if verbose:
+                print(f"Resuming from generation {start_gen}")
+        else:
+            self.best = None
+            self.best_score = float('-inf')
+            if self.history_path is not None:
+                self.reset_history_file()
+            pop, start_gen = self.init_population(), 0
+
+        pop = self.evolve(pop, max(0, self.gens - start_gen), start_gen, verbose=verbose)
+
+        if self.checkpoint_path:
+            self.save_checkpoint(pop, max(start_gen, self.gens))
+        self.flush_history()
+        if verbose and self.profiler is not None:
+            print(self.profiler.report())
+        return self.best, self.best_score
+
+    def run_islands(self, n_islands: int = 4, migration_interval: int = 10, n_migrants: int = 2,
+                    processes: int = None, verbose: bool = True) -> Tuple[List[int], int]:
+        """Island model: pop_size is split over n_islands sub-populations that evolve in a
+        process pool. Every migration_interval generations each island's top n_migrants
+        replace the worst individuals of the next island (ring). Each island gets its own
+        seed drawn from self.seed, so a seeded run is reproducible."""
+        if self.pop_size < 2 * n_islands:
+            raise ValueError(f"pop_size {self.pop_size} is too small for {n_islands} islands of at least 2")
+        # pop_size shared out as evenly as it goes, the first islands take the remainder
+        sizes = [len(part) for part in np.array_split(np.arange(self.pop_size), n_islands)]
+        seeds = random.Random(self.seed).sample(range(2**32), n_islands)
+        islands = [type(self)(size, self.gens, self.mut_rate, seed=s, selection=self.selection,
+                              tournament_size=self.tournament_size, profile=self.profiler is not None)
+                   for size, s in zip(sizes, seeds)]
+        pops = [ga.init_population() for ga in islands]
+        island_best = [[] for _ in islands]
+        island_avg = [[] for _ in islands]
+        n_migrants = min(n_migrants, min(sizes) - 1)
+
+        with Pool(processes) as pool:
+            for start in range(0, self.gens, migration_interval):
+                n_gens = min(migration_interval, self.gens - start)
+                results = pool.map(_evolve_island, [(ga, pop, start, n_gens) for ga, pop in zip(islands, pops)])
+                islands = [ga for ga, _ in results]
+                pops = [pop for _, pop in results]
+
+                # histories come back per epoch so they aren't shipped to the workers every time
+                for i, ga in enumerate(islands):
+                    island_best[i].extend(ga.best_history)
+                    island_avg[i].extend(ga.avg_history)
+                    ga.best_history, ga.avg_history = [], []
+
+                if n_migrants > 0 and start + n_gens < self.gens:
+                    migrants = [pop[:n_migrants].copy() for pop in pops]
+                    for i, pop in enumerate(pops):
+                        pop[-n_migrants:] = migrants[i - 1]
+
+                if verbose:
+                    print(f"Generation {start + n_gens - 1}: Current best = {max(ga.best_score for ga in islands)}")
+
+        self.island_best_history = island_best
+        self.island_avg_history = island_avg
+        self.best_history = [max(gen) for gen in zip(*island_best)]
+        self.avg_history = [sum(gen) / len(gen) for gen in zip(*island_avg)]
+        if self.profiler is not None:
+            for ga in islands:
+                self.profiler.merge(ga.profiler)
+            if verbose:
+                print(self.profiler.report())
+
+        top = max(islands, key=lambda ga: ga.best_score)
+        self.best, self.best_score = top.best, top.best_score
+        return self.best, self.best_score
+
+class VectorizedGeneticAlgorithm(GeneticAlgorithm):
+    """Same GA as above, but the population is one (pop_size, 32) uint8 array and every
+    generation is scored, selected, crossed and mutated with batched numpy calls."""
+
+    def __init__(self, pop_size: int = 50, gens: int = 100, mut_rate: float = 0.1, seed=None, **kwargs):
+        super().__init__(pop_size, gens, mut_rate, seed, **kwargs)
+        self.rng = np.random.default_rng(seed)
+        # +1 for each bit in a blue block, -1 for each bit in a green block
+        self.block_signs = np.repeat(np.array([1, -1, -1, 1], dtype=np.int64), 8)
+        self.bit_idx = np.arange(32)
+
+    def init_population(self) -> np.ndarray:
+        return self.rng.integers(0, 2, size=(self.pop_size, 32), dtype=np.uint8)
+
+    # the single genome operators of the list engine, drawing from the Generator instead
+    # of random.Random, for callers that still work one genome at a time
+
+    def make_random(self) -> List[int]:
+        return self.rng.integers(0, 2, size=32).tolist()
+
+    def crossover(self, p1: List[int], p2: List[int]) -> Tuple[List[int], List[int]]:
+        point = int(self.rng.integers(0, 32))
+        return p1[:point] + p2[point:], p2[:point] + p1[point:]
+
+    def mutate(self, bits: List[int]) -> List[int]:
+        flips = self.rng.random(len(bits)) < self.mut_rate
+        self.mutations_applied += int(np.count_nonzero(flips))
+        return [1 - bit if flip else bit for bit, flip in zip(bits, flips)]
+
+    def rank_population(self, pop: np.ndarray) -> np.ndarray:
+        return pop[np.argsort(-self.population_fitness(pop), kind='stable')]
+
+    def population_fitness(self, pop: np.ndarray) -> np.ndarray:
+        return pop @ self.block_signs
+
+    def roulette_wheel_selection(self, pop: np.ndarray, scores: np.ndarray, n: int) -> np.ndarray:
+        # negative scores get no share of the wheel, unlike the list version where they
+        # shrink the slices after them
+        weights = np.maximum(scores, 0)
+        total = weights.sum()
+        if total == 0:
+            return pop[self.rng.integers(0, len(pop), size=n)]
+
+        cum = np.cumsum(weights)
+        idx = np.searchsorted(cum, self.rng.uniform(0, total, size=n), side='right')
+        return pop[np.minimum(idx, len(pop) - 1)]
+
+    def tournament_selection(self, pop: np.ndarray, scores: np.ndarray, n: int) -> np.ndarray:
+        contenders = self.rng.integers(0, len(pop), size=(n, self.tournament_size))
+        winners = scores[contenders].argmax(axis=1)
+        return pop[contenders[np.arange(n), winners]]
+
+    def rank_selection(self, pop: np.ndarray, scores: np.ndarray, n: int) -> np.ndarray:
+        order = np.argsort(scores, kind='stable')
+        cum = np.cumsum(np.arange(1, len(pop) + 1))
+        idx = np.searchsorted(cum, self.rng.uniform(0, cum[-1], size=n), side='right')
+        return pop[order[np.minimum(idx, len(pop) - 1)]]
+
+    def crossover_all(self, p1: np.ndarray, p2: np.ndarray) -> np.ndarray:
+        points = self.rng.integers(0, 32, size=len(p1))
+        mask = self.bit_idx < points[:, None]
+        c1 = np.where(mask, p1, p2)
+        c2 = np.where(mask, p2, p1)
+        return np.concatenate((c1, c2))
+
+    def mutate_all(self, pop: np.ndarray) -> np.ndarray:
+        flips = self.rng.random(pop.shape) < self.mut_rate
+        self.mutations_applied += int(np.count_nonzero(flips))
+        return pop ^ flips.view(np.uint8)
+
+    def evolve(self, pop: np.ndarray, gens: int, start_gen: int = 0, verbose: bool = False) -> np.ndarray:
+        prof = self.profiler or NULL_PROFILER
+        hooks = self.generation_hooks(verbose)
+        n_pairs = (self.pop_size + 1) // 2
+
+        for gen in range(start_gen, start_gen + gens):
+            prof.start()
+            mutations_before = self.mutations_applied
+            scores = self.population_fitness(pop)
+            prof.lap('fitness')
+            parents = self.select_parents(pop, scores, 2 * n_pairs)
+            prof.lap('selection')
+            children = self.crossover_all(parents[:n_pairs], parents[n_pairs:])
+            prof.lap('crossover')
+            children = self.mutate_all(children)
+            prof.lap('mutation')
+
+            gen_best = int(scores.argmax())
+            gen_best_score = int(scores[gen_best])
+            avg_fitness = float(scores.mean())
+            improved = gen_best_score > self.best_score
+            self.record_generation(gen, gen_best_score, avg_fitness)
+            if improved:
+                self.best_score = gen_best_score
+                self.best = pop[gen_best].tolist()
+            pop = children[:self.pop_size]
+
+            if self.checkpoint_path and (gen + 1) % self.checkpoint_every == 0:
+                self.save_checkpoint(pop, gen + 1)
+            prof.lap('bookkeeping')
+            prof.count('evaluations', len(scores))
+            prof.count('selections', 2 * n_pairs)
+            prof.count('mutations', self.mutations_applied - mutations_before)
+            prof.end_generation()
+
+            if hooks:
+                self.call_hooks(hooks, gen, gen_best_score, avg_fitness, improved)
+
+        return pop
 
-        return best, best_score
+def _evolve_island(args):
+    # module level so the pool can pickle it
+    ga, pop, start_gen, n_gens = args
+    pop = ga.evolve(pop, n_gens, start_gen)
+    return ga, ga.rank_population(pop)
 
 def interactive_run():
     valid_mut = False
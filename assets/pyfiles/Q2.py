@@ -1,115 +1,775 @@
+import csv
+import os
+import pickle
 import random
+import sys
+import time
+from collections import OrderedDict
+from multiprocessing import Pool
 from typing import List, Tuple
-import matplotlib.pyplot as plt
+import numpy as np
+
+SELECTION_METHODS = {
+    "roulette": "roulette_wheel_selection",
+    "tournament": "tournament_selection",
+    "rank": "rank_selection",
+}
+
+HISTORY_NAMES = ["best_weight_history", "best_value_history", "avg_weight_history", "avg_value_history"]
+
+# max population bits converted to float per matrix product, keeps the temporary at ~32MB
+EVAL_CHUNK = 1 << 22
+
+# item count from which child_totals loops over crossover pairs instead of taking one
+# matrix product over all of them, where the two cost about the same
+PAIR_LOOP_ITEMS = 1500
+
+# largest n_items * (limit + 1) keep table main() will build for the exact baseline
+DP_MAX_CELLS = 2 * 10**8
+
+SEEDING_METHODS = ["greedy", "randomized"]
+
+# how overweight genomes are scored: zero fitness, greedy repair, or a graded penalty
+CONSTRAINT_METHODS = ["zero", "repair", "penalty"]
+
+# the coursework instance, used when no items file is given
+DEFAULT_ITEMS = {
+    1: {"weight": 3, "value": 126},
+    2: {"weight": 8, "value": 154},
+    3: {"weight": 2, "value": 256},
+    4: {"weight": 9, "value": 526},
+    5: {"weight": 7, "value": 388},
+    6: {"weight": 1, "value": 245},
+    7: {"weight": 8, "value": 210},
+    8: {"weight": 13, "value": 442},
+    9: {"weight": 10, "value": 671},
+    10: {"weight": 9, "value": 348}
+}
+DEFAULT_LIMIT = 35
+
+def pyplot(headless=False):
+    # lazy so island workers never import matplotlib, Agg when saving to file
+    import matplotlib
+    if headless and "matplotlib.pyplot" not in sys.modules:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+def show_or_save(plt, save_path=None):
+    if save_path is None:
+        plt.show()
+    else:
+        plt.savefig(save_path, dpi=150, bbox_inches="tight")
+        plt.close()
+
+class GenerationProfiler:
+    """Opt-in timers and counters for the phases of a generation. lap() charges the time
+    since the previous lap to the named phase, so the phases cover the whole generation."""
+
+    enabled = True
+    phases = ("fitness", "selection", "crossover", "mutation", "bookkeeping")
+
+    def __init__(self):
+        self.totals = dict.fromkeys(self.phases, 0.0)
+        self.last = dict.fromkeys(self.phases, 0.0)
+        self.counts = {}
+        self.generations = 0
+        self.mark = 0.0
+
+    def start(self):
+        self.last = dict.fromkeys(self.phases, 0.0)
+        self.mark = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.last[phase] += now - self.mark
+        self.mark = now
+
+    def count(self, name, n):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def end_generation(self):
+        for phase, seconds in self.last.items():
+            self.totals[phase] += seconds
+        self.generations += 1
+
+    def merge(self, other):
+        # adds an island's profile, generations then count island-generations
+        for phase, seconds in other.totals.items():
+            self.totals[phase] += seconds
+        for name, n in other.counts.items():
+            self.count(name, n)
+        self.generations += other.generations
+
+    def report(self):
+        total = sum(self.totals.values())
+        gens = max(self.generations, 1)
+        lines = [f"{self.generations} generations in {total:.3f}s ({1000 * total / gens:.3f} ms/gen)",
+                 f"{'phase':14}{'total s':>10}{'ms/gen':>10}{'share':>8}"]
+        for phase in self.phases:
+            seconds = self.totals[phase]
+            share = seconds / total if total else 0.0
+            lines.append(f"{phase:14}{seconds:10.3f}{1000 * seconds / gens:10.3f}{share:8.1%}")
+        for name, n in self.counts.items():
+            rate = f" ({n / total:,.0f}/s)" if total else ""
+            lines.append(f"{name:14}{n:>10,}{rate}")
+        return "\n".join(lines)
+
+class NullProfiler(GenerationProfiler):
+    # used when profiling is off, every hook is a no-op
+    enabled = False
+
+    def start(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+    def count(self, name, n):
+        pass
+
+    def end_generation(self):
+        pass
+
+NULL_PROFILER = NullProfiler()
 
 class Question2:
-    def __init__(self, items: dict, limit: int, pop_size: int = 50, gens: int = 100, mut_rate: float = 0.1):
+    # attributes that change during a run, saved in checkpoints
+    checkpoint_attrs = ("rng", "best", "best_score", "fitness_cache", "cache_hits", "cache_misses",
+                        "history_bytes", *HISTORY_NAMES)
+
+    def __init__(self, items: dict, limit: int, pop_size: int = 50, gens: int = 100, mut_rate: float = 0.1, seed=None,
+                 cache_size: int = 0, selection: str = "roulette", tournament_size: int = 3,
+                 checkpoint_path: str = None, checkpoint_every: int = 100, history_path: str = None,
+                 seed_fraction: float = 0.0, seeding: str = "randomized", constraint: str = "zero",
+                 penalty_rate: float = None, incremental: bool = False, profile: bool = False, callbacks=None):
+        """items is either the {index: {"weight", "value"}} dict used by interactive_run or an
+        (n_items, 2) array of weight, value rows, e.g. from load_items. seed_fraction of the
+        initial population is built with the greedy or randomized greedy solver (seeding).
+        constraint picks how overweight genomes are handled, see evaluate_population. With
+        incremental=True each genome's totals are carried between generations and only
+        updated for what crossover and mutation changed, instead of rescoring the genome.
+        profile=True times each phase of a generation (see GenerationProfiler), and every
+        callback is called as callback(ga, stats) after each generation."""
+        if selection not in SELECTION_METHODS:
+            raise ValueError(f"Unknown selection '{selection}', choose from {list(SELECTION_METHODS)}")
+        if seeding not in SEEDING_METHODS:
+            raise ValueError(f"Unknown seeding '{seeding}', choose from {SEEDING_METHODS}")
+        if constraint not in CONSTRAINT_METHODS:
+            raise ValueError(f"Unknown constraint '{constraint}', choose from {CONSTRAINT_METHODS}")
         self.items = items  
         self.limit = limit  
+
+        # contiguous (n_items, 2) table so a whole population is scored with one matrix product
+        if isinstance(items, dict):
+            table = np.array([[items[i]["weight"], items[i]["value"]] for i in sorted(items)], dtype=np.float64)
+        else:
+            table = np.asarray(items, dtype=np.float64)
+        self.item_table = np.ascontiguousarray(table)
+        self.n_items = len(table)
+        self.integral = bool(np.all(table == np.round(table)))
+        item_dtype = np.int64 if self.integral else np.float64
+        self.weights = table[:, 0].astype(item_dtype)
+        self.values = table[:, 1].astype(item_dtype)
+
         self.pop_size = pop_size  
         self.gens = gens  
         self.mut_rate = mut_rate  
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.selection = selection
+        self.tournament_size = tournament_size
+        self.seed_fraction = seed_fraction
+        self.seeding = seeding
+
+        # penalty is value lost per unit of excess weight, defaults to the best value density
+        # so an overweight genome never scores more than dropping the excess would give
+        self.constraint = constraint
+        if penalty_rate is None:
+            heavy = self.weights > 0
+            penalty_rate = float((self.values[heavy] / self.weights[heavy]).max()) if heavy.any() else 0.0
+        self.penalty_rate = penalty_rate
+        self.incremental = incremental
+
+        # LRU cache of genome key -> (weight, value), off when cache_size is 0. a lookup is a
+        # dict access per genome, so it only pays off when populations repeat many genomes
+        self.cache_size = cache_size
+        self.fitness_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self.best = None
+        self.best_score = float('-inf')
+
+        # periodic pickle of the run state, and optional csv that the per-generation
+        # stats are streamed to instead of the four history lists
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.history_path = history_path
+        self.history_buffer = []
+        self.history_bytes = 0
+
+        self.profiler = GenerationProfiler() if profile else None
+        self.callbacks = list(callbacks or [])
 
         self.best_weight_history = []  
         self.best_value_history = []   
         self.avg_weight_history = []   
         self.avg_value_history = []   
 
-    def make_random(self):
-        return [random.randint(0, 1) for _ in range(len(self.items))]
+    @staticmethod
+    def load_items(path):
+        """Loads an (n_items, 2) weight/value table from a .npy file or a csv with a header row."""
+        if str(path).endswith(".npy"):
+            return np.load(path)
+        return np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
 
-    def calculate_fitness(self, bits):
-        weight = 0
-        value = 0
+    @classmethod
+    def from_file(cls, path, limit, **kwargs):
+        return cls(cls.load_items(path), limit, **kwargs)
 
-        for i, bit in enumerate(bits, 1):
-            if bit == 1:
-                weight += self.items[i]["weight"]
-                value += self.items[i]["value"]
+    @staticmethod
+    def genome_key(bits):
+        # 8 bits per byte, much smaller than a tuple of the bits
+        return np.packbits(bits).tobytes()
 
+    def calculate_fitness(self, bits):
+        weight, value = self.genome_totals(bits)
         if weight > self.limit:  
             return 0, 0  
 
         return weight, value
 
-    def roulette_wheel_selection(self, pop, scores):
-        total = sum(scores)
+    def genome_totals(self, bits):
+        # total weight and value of one genome, through the LRU cache when it's on
+        if not self.cache_size:
+            return self.score_genome(bits)
+
+        key = self.genome_key(bits)
+        cached = self.fitness_cache.get(key)
+        if cached is not None:
+            self.fitness_cache.move_to_end(key)
+            self.cache_hits += 1
+            return cached
+
+        self.cache_misses += 1
+        result = self.score_genome(bits)
+        self.fitness_cache[key] = result
+        if len(self.fitness_cache) > self.cache_size:
+            self.fitness_cache.popitem(last=False)
+        return result
+
+    def score_genome(self, bits):
+        weights, values = self.score_population(np.asarray(bits, dtype=np.uint8)[None])
+        return weights.item(), values.item()
+
+    def score_population(self, pop):
+        # (pop, n_items) @ (n_items, 2) gives every genome's total weight and value at once
+        totals = np.empty((len(pop), 2))
+        step = max(1, EVAL_CHUNK // self.n_items)
+        for start in range(0, len(pop), step):
+            np.dot(pop[start:start + step], self.item_table, out=totals[start:start + step])
+
+        if self.integral:
+            totals = np.rint(totals).astype(np.int64)
+        return totals[:, 0], totals[:, 1]
+
+    def population_totals(self, pop):
+        if not self.cache_size:
+            return self.score_population(pop)
+
+        # every key is looked up first, then all the misses are scored in one
+        # score_population call, so the cache never costs a matmul per genome
+        totals = np.empty((len(pop), 2), dtype=np.int64 if self.integral else np.float64)
+        hit_rows, hit_totals = [], []
+        # missed maps each new key to its slot among the genomes to score, a repeat of a
+        # genome already missed in this population counts as a hit
+        missed, miss_rows, miss_slots, first_rows = {}, [], [], []
+        for i, row in enumerate(np.packbits(pop, axis=1)):
+            key = row.tobytes()
+            cached = self.fitness_cache.get(key)
+            if cached is not None:
+                self.fitness_cache.move_to_end(key)
+                hit_rows.append(i)
+                hit_totals.append(cached)
+                continue
+            slot = missed.setdefault(key, len(missed))
+            if slot == len(first_rows):
+                first_rows.append(i)
+            miss_rows.append(i)
+            miss_slots.append(slot)
+        self.cache_hits += len(hit_rows) + len(miss_rows) - len(missed)
+        self.cache_misses += len(missed)
+
+        if hit_rows:
+            totals[hit_rows] = hit_totals
+        if missed:
+            scored = np.column_stack(self.score_population(pop[first_rows]))
+            totals[miss_rows] = scored[miss_slots]
+            for key, result in zip(missed, scored.tolist()):
+                self.fitness_cache[key] = tuple(result)
+            while len(self.fitness_cache) > self.cache_size:
+                self.fitness_cache.popitem(last=False)
+        return totals[:, 0], totals[:, 1]
+
+    def evaluate_population(self, pop, totals=None):
+        """Returns (weights, values, fitness) for the population. weights/values are 0 for
+        genomes still over the limit, fitness is what selection uses:
+          zero    - overweight genomes get 0
+          repair  - overweight genomes are repaired in place (see repair) and scored normally
+          penalty - value minus penalty_rate per unit of excess weight, floored at 0
+        totals is an optional (pop_size, 2) array of known raw weight/value totals to use
+        instead of scoring pop, repair keeps it up to date."""
+        if totals is None:
+            weights, values = self.population_totals(pop)
+        else:
+            weights, values = totals[:, 0], totals[:, 1]
+        over = weights > self.limit
+
+        if self.constraint == "repair" and over.any():
+            weights[over], values[over] = self.repair(pop, np.flatnonzero(over), weights[over], values[over])
+            over[:] = False
+
+        if self.constraint == "penalty":
+            fitness = np.maximum(values - self.penalty_rate * np.maximum(weights - self.limit, 0), 0)
+
+        weights = np.where(over, 0, weights)
+        values = np.where(over, 0, values)
+        if self.constraint != "penalty":
+            fitness = values
+        return weights, values, fitness
+
+    def repair(self, pop, rows, weights, values):
+        """Greedy repair: drops the chosen items with the lowest value/weight first until each
+        genome in rows fits. Edits pop in place and returns the repaired weights and values."""
+        worst_first = self.density_order()[::-1]
+        w_sorted = self.weights[worst_first]
+        v_sorted = self.values[worst_first]
+        excess = weights - self.limit
+
+        step = max(1, EVAL_CHUNK // self.n_items)
+        for start in range(0, len(rows), step):
+            chunk = slice(start, start + step)
+            genes = pop[rows[chunk]][:, worst_first]
+            removed = np.cumsum(genes * w_sorted, axis=1)
+
+            # an item goes if it's chosen and the weight dropped before it is still short of the excess
+            drop = (genes == 1) & (removed - genes * w_sorted < excess[chunk, None])
+            weights[chunk] -= drop @ w_sorted
+            values[chunk] -= drop @ v_sorted
+            genes[drop] = 0
+            pop[rows[chunk, None], worst_first] = genes
+        return weights, values
+
+    def select_parents(self, pop, scores, n):
+        # draws all n parents of a generation in one call with the chosen strategy,
+        # returns their row indices so per-genome data can follow them
+        return getattr(self, SELECTION_METHODS[self.selection])(pop, scores, n)
+
+    def roulette_wheel_selection(self, pop, scores, n):
+        # wheel is built once per generation, each spin is then a binary search
+        cum = np.cumsum(scores)
+        total = cum[-1]
         if total == 0:
-            rand_choi = random.choice(pop)
-            print(f"All solutions invalid (total = 0), picking random: {rand_choi}")
-            return rand_choi
+            return self.rng.integers(0, len(pop), size=n)
 
-        rand = random.uniform(0, total)
-        curr = 0
+        idx = np.searchsorted(cum, self.rng.uniform(0, total, size=n), side="right")
+        return np.minimum(idx, len(pop) - 1)
 
-        for i in range(len(pop)):
-            curr += scores[i]
-            if curr > rand:
-                return pop[i]
+    def tournament_selection(self, pop, scores, n):
+        contenders = self.rng.integers(0, len(pop), size=(n, self.tournament_size))
+        winners = scores[contenders].argmax(axis=1)
+        return contenders[np.arange(n), winners]
 
-        return pop[-1]
+    def rank_selection(self, pop, scores, n):
+        # slices proportional to rank (worst = 1), so invalid genomes still get a small chance
+        order = np.argsort(scores, kind="stable")
+        cum = np.cumsum(np.arange(1, len(pop) + 1))
+        idx = np.searchsorted(cum, self.rng.uniform(0, cum[-1], size=n), side="right")
+        return order[np.minimum(idx, len(pop) - 1)]
 
     def crossover(self, p1, p2):
-        point = random.randint(0, len(p1) - 1)
-        c1 = p1[:point] + p2[point:]
-        c2 = p2[:point] + p1[point:]
-        return c1, c2
-
-    def mutate(self, bits):
-        new = bits.copy()
-        for i in range(len(new)):
-            if random.random() < self.mut_rate:
-                new[i] = 1 - new[i]
-        return new
-
-    def run_genetic_algorithm(self):
-        print("Creating initial population...")
-        pop = [self.make_random() for _ in range(self.pop_size)]
-
-        best = None
-        best_score = float('-inf')  
-
-        print("Starting evolution...")
-        for gen in range(self.gens):
-            scores = [self.calculate_fitness(p) for p in pop]
-            weights = [score[0] for score in scores]  
-            values = [score[1] for score in scores]   
-
-            max_weight = max(weights)
-            max_value = max(values)
-
-            avg_weight = sum(weights) / len(weights)
-            avg_value = sum(values) / len(values)
-
+        # single point crossover for every pair at once, row i of p1 and p2 are a pair
+        n_pairs = len(p1)
+        points = self.rng.integers(0, self.n_items, size=n_pairs)
+        head = np.arange(self.n_items) < points[:, None]
+
+        children = np.empty((2 * n_pairs, self.n_items), dtype=np.uint8)
+        children[:n_pairs] = p2
+        np.copyto(children[:n_pairs], p1, where=head)
+        children[n_pairs:] = p1
+        np.copyto(children[n_pairs:], p2, where=head)
+        return children, points
+
+    def child_totals(self, p1, p2, points, t1, t2):
+        """Raw totals of the crossover children from the parents' totals t1, t2. Child 1 is
+        t2 plus the difference of the parents' heads, child 2 is t1 minus it. Below
+        PAIR_LOOP_ITEMS items that difference is one masked matrix product over every pair,
+        above it the per pair Python overhead is small next to the sums, and each pair sums
+        only whichever side of its cut is shorter, so half the genes at most."""
+        diff = np.empty((len(points), 2))
+        if self.n_items < PAIR_LOOP_ITEMS:
+            step = max(1, EVAL_CHUNK // self.n_items)
+            cols = np.arange(self.n_items)
+            for start in range(0, len(points), step):
+                chunk = slice(start, start + step)
+                head = np.subtract(p1[chunk], p2[chunk], dtype=np.float64)
+                head *= cols < points[chunk, None]
+                np.dot(head, self.item_table, out=diff[chunk])
+        else:
+            half = self.n_items // 2
+            for i, point in enumerate(points):
+                if point <= half:
+                    head = p1[i, :point].astype(np.int8) - p2[i, :point]
+                    diff[i] = head @ self.item_table[:point]
+                else:
+                    tail = p1[i, point:].astype(np.int8) - p2[i, point:]
+                    diff[i] = (t1[i] - t2[i]) - tail @ self.item_table[point:]
+
+        if self.integral:
+            diff = np.rint(diff).astype(np.int64)
+        return np.concatenate((t2 + diff, t1 - diff))
+
+    def flip_deltas(self, pop, flips):
+        # change in raw totals from mutate, pop is already mutated so a set bit was added
+        rows, cols = np.divmod(flips, self.n_items)
+        sign = pop.reshape(-1)[flips].astype(np.int64) * 2 - 1
+        delta = np.column_stack([np.bincount(rows, weights=sign * self.item_table[cols, k], minlength=len(pop))
+                                 for k in range(2)])
+        if self.integral:
+            delta = np.rint(delta).astype(np.int64)
+        return delta
+
+    def flip_positions(self, n_bits):
+        # flat indices hit by a Bernoulli(mut_rate) draw per bit, sampled as geometric gaps
+        # between flips so the cost follows the number of flips instead of n_bits
+        if self.mut_rate <= 0:
+            return np.empty(0, dtype=np.int64)
+        if self.mut_rate >= 1:
+            return np.arange(n_bits)
+
+        expected = n_bits * self.mut_rate
+        batch = int(expected + 4 * np.sqrt(expected)) + 16
+        pos = np.cumsum(self.rng.geometric(self.mut_rate, size=batch)) - 1
+        while pos[-1] < n_bits:
+            pos = np.concatenate((pos, pos[-1] + np.cumsum(self.rng.geometric(self.mut_rate, size=batch))))
+        return pos[:np.searchsorted(pos, n_bits)]
+
+    def mutate(self, pop):
+        # flips bits of the (contiguous) population in place, returns the flat flipped indices
+        flips = self.flip_positions(pop.size)
+        pop.reshape(-1)[flips] ^= 1
+        return flips
+
+    def greedy_fill(self, order):
+        # takes items in the given order whenever they still fit
+        bits = np.zeros(self.n_items, dtype=np.uint8)
+        weights = self.weights[order]
+
+        # the run of items that fits before the first skip is taken in one go
+        first_skip = int(np.searchsorted(np.cumsum(weights), self.limit, side="right"))
+        bits[order[:first_skip]] = 1
+        room = self.limit - weights[:first_skip].sum()
+
+        lightest = weights.min() if self.n_items else 0
+        for i, w in zip(order[first_skip:].tolist(), weights[first_skip:].tolist()):
+            if room < lightest:
+                break
+            if w <= room:
+                bits[i] = 1
+                room -= w
+        return bits
+
+    def density_order(self, noise=0.0):
+        # items by value per unit weight, best first, zero weight items go first
+        with np.errstate(divide="ignore", invalid="ignore"):
+            density = np.where(self.weights > 0, self.values / self.weights, np.inf)
+        if noise:
+            density = density * self.rng.lognormal(0.0, noise, size=self.n_items)
+            return np.argsort(-density)
+        return np.argsort(-density, kind="stable")
+
+    def solve_greedy(self):
+        """Greedy value-density baseline, returns (bits, value)."""
+        bits = self.greedy_fill(self.density_order())
+        return bits.tolist(), (bits @ self.values).item()
+
+    def randomized_greedy(self, noise=0.3):
+        # greedy on densities scaled by lognormal noise, gives varied but good genomes
+        return self.greedy_fill(self.density_order(noise))
+
+    def solve_exact(self):
+        """Exact 0/1 knapsack by dynamic programming over capacities 0..limit, returns
+        (bits, value). Needs integer weights and takes O(n_items * limit) time and
+        n_items * limit bytes for the table used to recover the chosen items."""
+        if not np.all(self.weights == np.round(self.weights)):
+            raise ValueError("solve_exact needs integer weights")
+        cap = int(self.limit)
+        weights = self.weights.astype(np.int64)
+
+        best = np.zeros(cap + 1, dtype=self.values.dtype)
+        keep = np.zeros((self.n_items, cap + 1), dtype=bool)
+        for i in range(self.n_items):
+            w = weights[i]
+            if w > cap:
+                continue
+            take = best[:cap + 1 - w] + self.values[i]
+            better = take > best[w:]
+            keep[i, w:] = better
+            best[w:] = np.where(better, take, best[w:])
+
+        bits = np.zeros(self.n_items, dtype=np.uint8)
+        c = cap
+        for i in range(self.n_items - 1, -1, -1):
+            if keep[i, c]:
+                bits[i] = 1
+                c -= weights[i]
+        return bits.tolist(), best[cap].item()
+
+    def record_generation(self, gen, max_weight, max_value, avg_weight, avg_value):
+        if self.history_path is None:
             self.best_weight_history.append(max_weight)
             self.best_value_history.append(max_value)
             self.avg_weight_history.append(avg_weight)
             self.avg_value_history.append(avg_value)
-
-            if max_value > best_score:
-                best_score = max_value
-                best = pop[values.index(max_value)]
-                print(f"Gen {gen}: Found better solution! Value = {best_score}")
-
-            new_pop = []
-            while len(new_pop) < self.pop_size:
-                p1 = self.roulette_wheel_selection(pop, values)
-                p2 = self.roulette_wheel_selection(pop, values)
-                c1, c2 = self.crossover(p1, p2)
-                c1 = self.mutate(c1)
-                c2 = self.mutate(c2)
-                new_pop.append(c1)
-                new_pop.append(c2)
-
-            pop = new_pop[:self.pop_size]
-
-            if gen % 10 == 0:
-                print(f"Gen {gen}: Current best = {best_score}")
-
-        return best, best_score
-
-    def visualize_results(self):
+            return
+
+        self.history_buffer.append((gen, max_weight, max_value, avg_weight, avg_value))
+        if len(self.history_buffer) >= 1000:
+            self.flush_history()
+
+    def flush_history(self):
+        if self.history_path is None or not self.history_buffer:
+            return
+        with open(self.history_path, "a", newline="") as f:
+            csv.writer(f).writerows(self.history_buffer)
+            self.history_bytes = f.tell()
+        self.history_buffer = []
+
+    def reset_history_file(self):
+        with open(self.history_path, "w", newline="") as f:
+            csv.writer(f).writerow(["generation", "best_weight", "best_value", "avg_weight", "avg_value"])
+            self.history_bytes = f.tell()
+        self.history_buffer = []
+
+    def load_history(self):
+        """Reads a streamed history file back into the four history lists."""
+        self.flush_history()
+        with open(self.history_path, newline="") as f:
+            rows = list(csv.reader(f))[1:]
+        for col, name in enumerate(HISTORY_NAMES, 1):
+            setattr(self, name, [float(row[col]) for row in rows])
+
+    def save_checkpoint(self, pop, next_gen):
+        # flush history first so the csv is never behind the checkpoint
+        self.flush_history()
+        state = {name: getattr(self, name) for name in self.checkpoint_attrs}
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"gen": next_gen, "pop": pop, "state": state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def load_checkpoint(self):
+        with open(self.checkpoint_path, "rb") as f:
+            checkpoint = pickle.load(f)
+        for name, value in checkpoint["state"].items():
+            setattr(self, name, value)
+        self.history_buffer = []
+
+        # drop rows written after the checkpoint, they get regenerated
+        if self.history_path is not None:
+            with open(self.history_path, "r+b") as f:
+                f.truncate(self.history_bytes)
+        return checkpoint["pop"], checkpoint["gen"]
+
+    def init_population(self):
+        pop = self.rng.integers(0, 2, size=(self.pop_size, self.n_items), dtype=np.uint8)
+
+        n_seeded = int(round(self.pop_size * self.seed_fraction))
+        if n_seeded and self.seeding == "greedy":
+            pop[:n_seeded] = self.greedy_fill(self.density_order())
+        else:
+            for i in range(n_seeded):
+                pop[i] = self.randomized_greedy()
+        return pop
+
+    def make_island(self, pop_size, seed):
+        # same settings on a smaller population, checkpoints and history files stay with the parent
+        return Question2(self.items, self.limit, pop_size, self.gens, self.mut_rate, seed=seed,
+                         cache_size=self.cache_size, selection=self.selection,
+                         tournament_size=self.tournament_size, seed_fraction=self.seed_fraction,
+                         seeding=self.seeding, constraint=self.constraint, penalty_rate=self.penalty_rate,
+                         incremental=self.incremental, profile=self.profiler is not None)
+
+    def rank_population(self, pop):
+        # fittest (highest value) first, used for migration between islands
+        _, _, fitness = self.evaluate_population(pop)
+        return pop[np.argsort(-fitness, kind="stable")]
+
+    def evolve(self, pop, gens, start_gen=0, verbose=True):
+        prof = self.profiler or NULL_PROFILER
+        hooks = self.callbacks + [type(self).log_progress] if verbose else list(self.callbacks)
+        n_pairs = (self.pop_size + 1) // 2
+        totals = None
+
+        for gen in range(start_gen, start_gen + gens):
+            prof.start()
+            if self.incremental and totals is None:
+                totals = np.column_stack(self.population_totals(pop))
+            weights, values, fitness = self.evaluate_population(pop, totals)
+            prof.lap("fitness")
+
+            idx = self.select_parents(pop, fitness, 2 * n_pairs)
+            parents = pop[idx]
+            prof.lap("selection")
+
+            children, points = self.crossover(parents[:n_pairs], parents[n_pairs:])
+            if self.incremental:
+                parent_totals = totals[idx]
+                child_totals = self.child_totals(parents[:n_pairs], parents[n_pairs:], points,
+                                                 parent_totals[:n_pairs], parent_totals[n_pairs:])
+            prof.lap("crossover")
+
+            flips = self.mutate(children)
+            if self.incremental:
+                child_totals += self.flip_deltas(children, flips)
+                totals = child_totals[:self.pop_size]
+            prof.lap("mutation")
+
+            best_idx = int(values.argmax())
+            max_weight = weights.max().item()
+            max_value = values[best_idx].item()
+            avg_weight = float(weights.mean())
+            avg_value = float(values.mean())
+            self.record_generation(gen, max_weight, max_value, avg_weight, avg_value)
+
+            improved = max_value > self.best_score
+            if improved:
+                self.best_score = max_value
+                self.best = pop[best_idx].tolist()
+            pop = children[:self.pop_size]
+
+            if self.checkpoint_path and (gen + 1) % self.checkpoint_every == 0:
+                self.save_checkpoint(pop, gen + 1)
+            prof.lap("bookkeeping")
+            prof.count("evaluations", len(values))
+            prof.count("selections", 2 * n_pairs)
+            prof.count("mutations", len(flips))
+            prof.end_generation()
+
+            if hooks:
+                stats = {"gen": gen, "best_weight": max_weight, "best_value": max_value,
+                         "avg_weight": avg_weight, "avg_value": avg_value, "best_so_far": self.best_score,
+                         "improved": improved, "feasible": int(np.count_nonzero(fitness))}
+                if self.profiler is not None:
+                    stats["times"] = dict(self.profiler.last)
+                for hook in hooks:
+                    hook(self, stats)
+
+        return pop
+
+    def log_progress(self, stats):
+        # default hook for verbose runs
+        gen = stats["gen"]
+        if stats["improved"]:
+            print(f"Gen {gen}: Found better solution! Value = {stats['best_so_far']}")
+        if self.selection == "roulette" and not stats["feasible"]:
+            print(f"Gen {gen}: All solutions invalid, picking random parents")
+        if gen % 10 == 0:
+            print(f"Gen {gen}: Current best = {stats['best_so_far']}")
+
+    def run_genetic_algorithm(self, verbose=True, resume=False):
+        """Runs the GA. With resume=True and an existing checkpoint_path it carries on from
+        the last checkpoint instead of starting a new population."""
+        if resume and self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            pop, start_gen = self.load_checkpoint()
+            if verbose:
+                print(f"Resuming from generation {start_gen}...")
+        else:
+            if verbose:
+                print("Creating initial population...")
+            pop, start_gen = self.init_population(), 0
+
+            self.best = None
+            self.best_score = float('-inf')
+            if self.history_path is not None:
+                self.reset_history_file()
+
+        if verbose:
+            print("Starting evolution...")
+        pop = self.evolve(pop, max(0, self.gens - start_gen), start_gen, verbose=verbose)
+
+        if self.checkpoint_path:
+            self.save_checkpoint(pop, max(start_gen, self.gens))
+        self.flush_history()
+        if verbose and self.profiler is not None:
+            print(self.profiler.report())
+
+        return self.best, self.best_score
+
+    def run_islands(self, n_islands=4, migration_interval=10, n_migrants=2, processes=None, verbose=True):
+        """Island model version of run_genetic_algorithm. pop_size is split over n_islands
+        sub-populations evolved in a process pool, and every migration_interval generations
+        each island's top n_migrants replace the worst of the next island (ring). Island
+        seeds are drawn from self.seed so seeded runs are reproducible."""
+        if self.pop_size < 2 * n_islands:
+            raise ValueError(f"pop_size {self.pop_size} is too small for {n_islands} islands of at least 2")
+        # pop_size shared out as evenly as it goes, the first islands take the remainder
+        sizes = [len(part) for part in np.array_split(np.arange(self.pop_size), n_islands)]
+        seeds = random.Random(self.seed).sample(range(2**32), n_islands)
+        islands = [self.make_island(size, s) for size, s in zip(sizes, seeds)]
+        pops = [ga.init_population() for ga in islands]
+        island_histories = [{name: [] for name in HISTORY_NAMES} for _ in islands]
+        n_migrants = min(n_migrants, min(sizes) - 1)
+
+        with Pool(processes) as pool:
+            for start in range(0, self.gens, migration_interval):
+                n_gens = min(migration_interval, self.gens - start)
+                results = pool.map(_evolve_island, [(ga, pop, start, n_gens) for ga, pop in zip(islands, pops)])
+                islands = [ga for ga, _ in results]
+                pops = [pop for _, pop in results]
+
+                # histories come back per epoch so they aren't shipped to the workers every time
+                for ga, hist in zip(islands, island_histories):
+                    for name in HISTORY_NAMES:
+                        hist[name].extend(getattr(ga, name))
+                        setattr(ga, name, [])
+
+                if n_migrants > 0 and start + n_gens < self.gens:
+                    migrants = [pop[:n_migrants].copy() for pop in pops]
+                    for i, pop in enumerate(pops):
+                        pop[-n_migrants:] = migrants[i - 1]
+
+                if verbose:
+                    print(f"Gen {start + n_gens - 1}: Current best = {max(ga.best_score for ga in islands)}")
+
+        self.island_histories = island_histories
+        for name in HISTORY_NAMES:
+            per_gen = zip(*(hist[name] for hist in island_histories))
+            if name.startswith("best"):
+                setattr(self, name, [max(gen) for gen in per_gen])
+            else:
+                setattr(self, name, [sum(gen) / len(gen) for gen in per_gen])
+
+        self.cache_hits = sum(ga.cache_hits for ga in islands)
+        self.cache_misses = sum(ga.cache_misses for ga in islands)
+        if self.profiler is not None:
+            for ga in islands:
+                self.profiler.merge(ga.profiler)
+            if verbose:
+                print(self.profiler.report())
+
+        top = max(islands, key=lambda ga: ga.best_score)
+        self.best, self.best_score = top.best, top.best_score
+        return self.best, self.best_score
+
+    def visualize_results(self, save_path=None):
         """Visualizes the weight, value, and price-per-kilo evolution over generations."""
+        if self.history_path is not None:
+            self.load_history()
+        plt = pyplot(headless=save_path is not None)
         plt.figure(figsize=(18, 6))  
         
        
@@ -153,7 +813,7 @@ class Question2:
 
         
         plt.tight_layout()
-        plt.show()
+        show_or_save(plt, save_path)
 
     def main(self):
         best, score = self.run_genetic_algorithm()
@@ -169,15 +829,25 @@ class Question2:
 
         for i, selected in enumerate(best, 1):
             if selected:
-                w = self.items[i]["weight"]
-                v = self.items[i]["value"]
+                w = self.weights[i - 1]
+                v = self.values[i - 1]
                 total_w += w
-                print(f"{i:4d} | {w:6d} | {v:5d}")
+                print(f"{i:4d} | {w:6} | {v:5}")
 
         print("-" * 25)
         print(f"Total weight (tonnes): {total_w}")
         print(f"Total value (£ thousands): {score}")
 
+        if self.cache_size:
+            print(f"Fitness cache: {self.cache_hits} hits, {self.cache_misses} misses")
+
+        _, greedy_value = self.solve_greedy()
+        print(f"\nGreedy baseline (£ thousands): {greedy_value}")
+        if np.all(self.weights == np.round(self.weights)) and self.n_items * (self.limit + 1) <= DP_MAX_CELLS:
+            _, optimum = self.solve_exact()
+            gap = 100 * (optimum - score) / optimum if optimum else 0
+            print(f"Exact optimum (£ thousands): {optimum} (GA is {gap:.1f}% below)")
+
     @staticmethod
     def interactive_run():
         while True:
@@ -187,26 +857,20 @@ class Question2:
                 pop_size = int(input("Enter population size (defaults 50): ") or 50)
                 gens = int(input("Enter number of generations (defaults 100): ") or 100)
                 mut_rate = float(input("Enter mutation rate (0-1, defaults 0.1): ") or 0.1)
+                items_path = input("Items file, csv or .npy (blank for the built-in 10 items): ").strip()
+                limit = float(input("Enter weight limit: ")) if items_path else DEFAULT_LIMIT
+                constraint = input("Overweight handling, zero/repair/penalty (defaults zero): ").strip() or "zero"
 
                 print("\nRunning algorithm with:")
                 print(f"Population Size: {pop_size}")
                 print(f"Generations: {gens}")
                 print(f"Mutation Rate: {mut_rate}")
+                print(f"Overweight handling: {constraint}")
+
+                items = Question2.load_items(items_path) if items_path else DEFAULT_ITEMS
 
-                items = {
-                    1: {"weight": 3, "value": 126},
-                    2: {"weight": 8, "value": 154},
-                    3: {"weight": 2, "value": 256},
-                    4: {"weight": 9, "value": 526},
-                    5: {"weight": 7, "value": 388},
-                    6: {"weight": 1, "value": 245},
-                    7: {"weight": 8, "value": 210},
-                    8: {"weight": 13, "value": 442},
-                    9: {"weight": 10, "value": 671},
-                    10: {"weight": 9, "value": 348}
-                }
-
-                ga = Question2(items, limit=35, pop_size=pop_size, gens=gens, mut_rate=mut_rate)
+                ga = Question2(items, limit=limit, pop_size=pop_size, gens=gens, mut_rate=mut_rate,
+                               constraint=constraint)
                 ga.main()
                 ga.visualize_results()
 
@@ -215,6 +879,14 @@ class Question2:
 
             except ValueError:
                 print("Invalid input")
+            except OSError as e:
+                print(f"Could not load items: {e}")
+
+def _evolve_island(args):
+    # module level so the pool can pickle it
+    ga, pop, start_gen, n_gens = args
+    pop = ga.evolve(pop, n_gens, start_gen, verbose=False)
+    return ga, ga.rank_population(pop)
 
 if __name__ == "__main__":
     Question2.interactive_run()
\ No newline at end of file
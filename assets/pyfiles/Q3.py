@@ -1,16 +1,212 @@
+import math
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
+
+def pyplot(headless=False):
+    # imported on first plot only, Agg backend when there's no window to show
+    import matplotlib
+    if headless and "matplotlib.pyplot" not in sys.modules:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+def show_or_save(plt, save_path=None):
+    if save_path is None:
+        plt.show()
+    else:
+        plt.savefig(save_path, dpi=150, bbox_inches="tight")
+        plt.close()
+
+# the layers below are Q4's Dense and Sequential without dropout, so every weight and
+# gradient is a view into one flat array and a step is one update over all of them
+
+# what a Dense layer can apply to x @ weights + bias, linear is the output layer's
+ACTIVATIONS = ["leaky_relu", "relu", "tanh", "linear"]
+
+# leaky_relu's slope below zero
+LEAKY_SLOPE = 0.01
+
+# activations per stacked group in NeuralNet.train_many, sized to stay in cache
+STACK_CELLS = 1 << 16
+
+class Dense:
+    """A fully connected layer, activation(x @ weights + bias). weights and bias, and their
+    gradients grad_weights and grad_bias, are views the owning Sequential sets up into its
+    flat arrays."""
+
+    def __init__(self, n_in, n_out, activation="relu"):
+        if activation not in ACTIVATIONS:
+            raise ValueError(f"Unknown activation '{activation}', choose from {ACTIVATIONS}")
+        self.n_in = n_in
+        self.n_out = n_out
+        self.activation = activation
+        self.weights = self.bias = None
+        self.grad_weights = self.grad_bias = None
+
+    @property
+    def shapes(self):
+        return [(self.n_in, self.n_out), (1, self.n_out)]
+
+    def workspace(self, n_rows, dtype):
+        # pre-activation z, activation a (z itself when linear), the loss gradient wrt the
+        # output then wrt z, plus what the activation's derivative needs
+        z = np.empty((n_rows, self.n_out), dtype)
+        ws = {"z": z, "a": z if self.activation == "linear" else np.empty_like(z), "delta": np.empty_like(z)}
+        if self.activation == "leaky_relu":
+            ws["neg"] = np.empty(z.shape, dtype=bool)
+        elif self.activation == "relu":
+            ws["active"] = np.empty_like(z)
+        elif self.activation == "tanh":
+            ws["slope"] = np.empty_like(z)
+        return ws
+
+    def forward(self, x, ws=None):
+        """The layer's output for x, a new array without ws, written into ws (training) with it."""
+        if ws is None:
+            z = x @ self.weights
+            z += self.bias
+            a = z if self.activation == "linear" else np.empty_like(z)
+            self.activate(z, a)
+            return a
+        # np.dot rather than matmul here and in backward, matmul is several times slower on
+        # the products with a single column or row this net has
+        z, a = ws["z"], ws["a"]
+        np.dot(x, self.weights, out=z)
+        z += self.bias
+        self.activate(z, a)
+        return a
+
+    def activate(self, z, out):
+        if self.activation == "leaky_relu":
+            # max(z, slope * z) is the leaky relu for slope < 1, written without temporaries
+            np.multiply(z, LEAKY_SLOPE, out=out)
+            np.maximum(z, out, out=out)
+        elif self.activation == "relu":
+            np.maximum(z, 0, out=out)
+        elif self.activation == "tanh":
+            np.tanh(z, out=out)
+
+    def backward(self, x, ws, prev_delta=None):
+        """Backprop from ws's delta, the loss gradient wrt this layer's output as left by the
+        forward pass on x, which is turned into the gradient wrt z in place. Writes the batch
+        mean gradients and, given prev_delta, the gradient wrt x into it."""
+        delta = ws["delta"]
+        if self.activation == "leaky_relu":
+            np.less_equal(ws["z"], 0, out=ws["neg"])
+            np.multiply(delta, LEAKY_SLOPE, out=delta, where=ws["neg"])
+        elif self.activation == "relu":
+            # times a 0/1 mask, several times faster than a masked write at these sizes
+            np.greater(ws["z"], 0, out=ws["active"])
+            delta *= ws["active"]
+        elif self.activation == "tanh":
+            # 1 - tanh(z)^2, into its own buffer so a is left as it was
+            slope = ws["slope"]
+            np.tanh(ws["z"], out=slope)
+            np.square(slope, out=slope)
+            np.subtract(1, slope, out=slope)
+            delta *= slope
+
+        # batch means, so the step size doesn't grow with the number of points
+        np.dot(x.T, delta, out=self.grad_weights)
+        self.grad_weights /= len(delta)
+        np.mean(delta, axis=0, keepdims=True, out=self.grad_bias)
+        if prev_delta is not None:
+            np.dot(delta, self.weights.T, out=prev_delta)
+
+class Sequential:
+    """Dense layers applied in order. Every layer's weights and biases are views into one
+    flat array, params, and their gradients into another, grads, so a gradient descent
+    step is two whole array ops however deep the net is."""
+
+    def __init__(self, layers, dtype=np.float64):
+        self.layers = list(layers)
+        self.dtype = np.dtype(dtype)
+        self.shapes = [shape for layer in self.layers for shape in layer.shapes]
+        n_params = sum(math.prod(shape) for shape in self.shapes)
+        self.grads = np.zeros(n_params, self.dtype)
+        views = split_flat(self.grads, self.shapes)
+        for layer, grad_weights, grad_bias in zip(self.layers, views[0::2], views[1::2]):
+            layer.grad_weights, layer.grad_bias = grad_weights, grad_bias
+        self.params = np.zeros(n_params, self.dtype)
+        views = split_flat(self.params, self.shapes)
+        for layer, weights, bias in zip(self.layers, views[0::2], views[1::2]):
+            layer.weights, layer.bias = weights, bias
+        # training buffers per batch size, see workspace
+        self.workspaces = {}
+
+    def init_weights(self, rng=np.random):
+        # xavier initialisation from np.random or a RandomState, and zero biases
+        for layer in self.layers:
+            layer.weights[...] = rng.randn(layer.n_in, layer.n_out) / np.sqrt(layer.n_in)
+            layer.bias[...] = 0
+
+    def forward(self, x):
+        for layer in self.layers:
+            x = layer.forward(x)
+        return x
+
+    def workspace(self, n_rows):
+        """Every array backprop writes to, allocated once per batch size."""
+        if n_rows not in self.workspaces:
+            self.workspaces[n_rows] = {
+                "layers": [layer.workspace(n_rows, self.dtype) for layer in self.layers],
+                "sq_error": np.empty((n_rows, self.layers[-1].n_out), self.dtype),
+            }
+        return self.workspaces[n_rows]
+
+    def backprop(self, X, y):
+        """Forward and backward pass on a batch, leaving the batch mean gradients in grads.
+        Returns the batch mse loss."""
+        ws = self.workspace(len(X))
+        layer_ws = ws["layers"]
+        inputs = [X]
+        for layer, lws in zip(self.layers, layer_ws):
+            inputs.append(layer.forward(inputs[-1], lws))
+
+        # the output error is the loss gradient wrt the output, mse's factor 2 left out
+        error = layer_ws[-1]["delta"]
+        np.subtract(inputs[-1], y.reshape(len(X), -1), out=error)
+        sq_error = ws["sq_error"]
+        np.square(error, out=sq_error)
+        loss = float(sq_error.mean(dtype=np.float64))
+
+        for i in reversed(range(len(self.layers))):
+            self.layers[i].backward(inputs[i], layer_ws[i], layer_ws[i - 1]["delta"] if i else None)
+        return loss
+
+def split_flat(flat, shapes):
+    # consecutive views of a 1d array with the given shapes
+    views, offset = [], 0
+    for shape in shapes:
+        size = math.prod(shape)
+        views.append(flat[offset:offset + size].reshape(shape))
+        offset += size
+    return views
 
 class NeuralNet:
-    def __init__(self, hidden_size=32, lr=0.0005, epochs=5000):
-        self.hidden_size = hidden_size
+    """A Sequential of Dense layers fitted to y = 3x + 0.7x^2 by full batch gradient
+    descent. hidden_sizes gives the hidden layer widths (one layer of hidden_size when not
+    given), activations one name from ACTIVATIONS for every hidden layer or a list with
+    one per layer, and the output is linear. The weights are drawn from np.random."""
+
+    def __init__(self, hidden_size=32, lr=0.0005, epochs=5000, hidden_sizes=None, activations="relu"):
+        hidden_sizes = list(hidden_sizes) if hidden_sizes is not None else [hidden_size]
+        activations = [activations] * len(hidden_sizes) if isinstance(activations, str) else list(activations)
+        if not hidden_sizes:
+            raise ValueError("hidden_sizes needs at least one layer")
+        if len(activations) != len(hidden_sizes):
+            raise ValueError("activations needs one entry per hidden layer")
+        for activation in activations:
+            if activation not in ACTIVATIONS:
+                raise ValueError(f"Unknown activation '{activation}', choose from {ACTIVATIONS}")
+        self.hidden_size = hidden_sizes[0]
+        self.hidden_sizes = hidden_sizes
+        self.activations = activations
         self.lr = lr  # learning rate
         self.epochs = epochs
         
-        self.w1 = None
-        self.b1 = None
-        self.w2 = None
-        self.b2 = None
+        # the Sequential, built by init_network
+        self.model = None
         self.loss_hist = []
         
     def make_data(self):
@@ -24,27 +220,29 @@ class NeuralNet:
         std = data.std()
         return (data - mean) / std, mean, std
     
+    def build_model(self, input_size=1):
+        # the hidden layers, then a linear output. weights are all zero
+        sizes = [input_size, *self.hidden_sizes]
+        layers = [Dense(n_in, n_out, activation) for n_in, n_out, activation in zip(sizes, sizes[1:], self.activations)]
+        layers.append(Dense(sizes[-1], 1, "linear"))
+        self.model = Sequential(layers)
+
     def init_network(self):
-        # xavier initialization for weights
-        input_size = 1
-        output_size = 1
-        self.w1 = np.random.randn(input_size, self.hidden_size) / np.sqrt(input_size)
-        self.b1 = np.zeros((1, self.hidden_size))
-        self.w2 = np.random.randn(self.hidden_size, output_size) / np.sqrt(self.hidden_size)
-        self.b2 = np.zeros((1, output_size))
-    
-    def relu(self, x):
-        return np.maximum(0, x)
-    
-    def relu_deriv(self, x):
-        return (x > 0).astype(float)
+        self.build_model()
+        self.model.init_weights()
     
     def forward(self, x):
         # run input through network
-        h_sum = np.dot(x, self.w1) + self.b1
-        h_out = self.relu(h_sum)
-        out = np.dot(h_out, self.w2) + self.b2
-        return out, h_out, h_sum
+        return self.model.forward(x)
+
+    def train_step(self, x, y):
+        """One gradient descent step on the batch mean gradients, taken over the flat params
+        in one go. Returns the loss before the step."""
+        loss = self.model.backprop(x, y)
+        grads = self.model.grads
+        grads *= self.lr
+        self.model.params -= grads
+        return loss
     
     def train(self, verbose=True):
         # prep data
@@ -56,44 +254,108 @@ class NeuralNet:
         
         if verbose:
             print("Starting training...")
-            
+
+        # every buffer the steps write to is allocated on the first one, see Sequential.workspace
         for epoch in range(self.epochs):
-            # forward pass
-            pred, h_out, h_sum = self.forward(x_norm)
-            
-            # backprop
-            error = pred - y_norm
-            
-            # output layer gradients
-            w2_delta = np.dot(h_out.T, error) / x.shape[0]
-            b2_delta = error.mean(axis=0, keepdims=True)
-            
-            # hidden layer gradients
-            h_error = np.dot(error, self.w2.T) * self.relu_deriv(h_sum)
-            w1_delta = np.dot(x_norm.T, h_error) / x.shape[0]
-            b1_delta = h_error.mean(axis=0, keepdims=True)
-            
-            # update weights
-            self.w2 -= self.lr * w2_delta
-            self.b2 -= self.lr * b2_delta
-            self.w1 -= self.lr * w1_delta
-            self.b1 -= self.lr * b1_delta
-            
-            # track loss
-            loss = (error**2).mean()
+            loss = self.train_step(x_norm, y_norm)
             self.loss_hist.append(loss)
             
             if verbose and epoch % 500 == 0:
                 print(f"Epoch {epoch}: Loss = {loss:.6f}")
-    
-    def plot_results(self):
+
+    @classmethod
+    def train_many(cls, configs, verbose=False):
+        """Trains one network per config, stacked so they share each numpy call. Each config
+        is a dict of hidden_size, lr, epochs and seed (missing ones take the constructor
+        defaults, no seed uses the global np.random state). Returns the trained NeuralNets,
+        each with its own weights and loss_hist, matching what train() gives for that seed.
+        The stacking is written for the default network, one relu hidden layer."""
+        nets = [cls(**{k: v for k, v in config.items() if k != "seed"}) for config in configs]
+        if any(len(net.hidden_sizes) != 1 or net.activations != ["relu"] for net in nets):
+            raise ValueError("train_many only stacks nets with one relu hidden layer, train() the others")
+        x, y = nets[0].make_data()
+        x_norm, _, _ = nets[0].normalise(x)
+        y_norm, _, _ = nets[0].normalise(y)
+
+        # stacks bigger than cache are slower per model than small ones, so models are
+        # trained in groups of about STACK_CELLS hidden activations
+        start = 0
+        while start < len(nets):
+            stop = start + 1
+            while stop < len(nets) and (stop - start + 1) * len(x) * max(
+                    net.hidden_size for net in nets[start:stop + 1]) <= STACK_CELLS:
+                stop += 1
+            if verbose:
+                print(f"Training models {start}-{stop - 1} of {len(nets)}")
+            cls.train_stack(nets[start:stop], configs[start:stop], x_norm, y_norm, verbose)
+            start = stop
+        return nets
+
+    @staticmethod
+    def train_stack(nets, configs, x_norm, y_norm, verbose=False):
+        # weights get a leading model axis, with the biases folded in as an extra row:
+        # w1 and b1 as (m, 2, hidden) against [x, 1], w2 and b2 as (m, hidden + 1, 1) against
+        # [h_out, 1]. smaller hidden layers are zero padded, a padded unit never activates
+        # and has no output weight, so it gets zero gradients and stays zero
+        n_models = len(nets)
+        n = len(x_norm)
+        hidden = max(net.hidden_size for net in nets)
+        x_aug = np.hstack([x_norm, np.ones_like(x_norm)])
+
+        layer1 = np.zeros((n_models, 2, hidden))
+        layer2 = np.zeros((n_models, hidden + 1, 1))
+        for m, (net, config) in enumerate(zip(nets, configs)):
+            # same draws as init_network after np.random.seed(seed)
+            rng = np.random.RandomState(config["seed"]) if config.get("seed") is not None else np.random
+            layer1[m, 0, :net.hidden_size] = rng.randn(net.hidden_size)
+            layer2[m, :net.hidden_size, 0] = rng.randn(net.hidden_size) / np.sqrt(net.hidden_size)
+
+        lr = np.array([net.lr for net in nets])
+        epochs = np.array([net.epochs for net in nets])
+        losses = np.empty((epochs.max(), n_models))
+        h_out = np.ones((n_models, n, hidden + 1))
+        active = np.empty((n_models, n, hidden))
+
+        for epoch in range(epochs.max()):
+            # models that have used up their epochs keep their weights
+            step = (np.where(epoch < epochs, lr, 0.0) / n).reshape(-1, 1, 1)
+
+            h_sum = x_aug @ layer1
+            np.maximum(h_sum, 0, out=h_out[:, :, :hidden])
+            error = h_out @ layer2 - y_norm
+
+            # h_error = (error @ w2.T) * relu'(h_sum) is never built: w2 is a column, so its
+            # factor comes out of the sum and layer1_delta = w2.T * (relu'(h_sum).T @ (x_aug * error))
+            np.greater(h_sum, 0, out=active)
+            layer2_delta = h_out.transpose(0, 2, 1) @ error
+            layer1_delta = (active.transpose(0, 2, 1) @ (x_aug * error)).transpose(0, 2, 1)
+            layer1_delta *= layer2[:, :hidden].transpose(0, 2, 1)
+
+            layer2 -= step * layer2_delta
+            layer1 -= step * layer1_delta
+
+            losses[epoch] = (error**2).mean(axis=(1, 2))
+
+            if verbose and epoch % 500 == 0:
+                print(f"Epoch {epoch}: Best loss = {losses[epoch].min():.6f}")
+
+        for m, net in enumerate(nets):
+            h = net.hidden_size
+            net.build_model()
+            hidden_layer, output_layer = net.model.layers
+            hidden_layer.weights[...], hidden_layer.bias[...] = layer1[m, :1, :h], layer1[m, 1:, :h]
+            output_layer.weights[...], output_layer.bias[...] = layer2[m, :h], layer2[m, hidden:]
+            net.loss_hist = losses[:net.epochs, m].tolist()
+
+    def plot_results(self, save_path=None):
         x, y = self.make_data()
         x_norm, x_mean, x_std = self.normalise(x)
         _, y_mean, y_std = self.normalise(y)
         
-        pred_norm = self.forward(x_norm)[0]
+        pred_norm = self.forward(x_norm)
         pred = pred_norm * y_std + y_mean
         
+        plt = pyplot(headless=save_path is not None)
         plt.figure(figsize=(12, 6))
         
         # plot predictions vs actual
@@ -115,7 +377,7 @@ class NeuralNet:
         plt.grid(True)
         
         plt.tight_layout()
-        plt.show()
+        show_or_save(plt, save_path)
         
     def test_predictions(self):
         test_x = np.array([-8, -4, 0, 4, 8]).reshape(-1, 1)
@@ -123,7 +385,7 @@ class NeuralNet:
         test_norm, x_mean, x_std = self.normalise(test_x)
         _, y_mean, y_std = self.normalise(3 * test_x + 0.7 * test_x**2)
         
-        pred_norm = self.forward(test_norm)[0]
+        pred_norm = self.forward(test_norm)
         pred = pred_norm * y_std + y_mean
         
        # print("\nTest Point Predictions:")
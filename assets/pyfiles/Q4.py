@@ -1,160 +1,1095 @@
+import argparse
+import collections
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import queue
+import sys
+import threading
 import numpy as np
-import matplotlib.pyplot as plt
+from multiprocessing import Pool, shared_memory
 from pathlib import Path
 
+def pyplot(headless=False):
+    # imported when plotting rather than at import time, Agg backend for file output
+    import matplotlib
+    if headless and "matplotlib.pyplot" not in sys.modules:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+def show_or_save(plt, save_path=None):
+    if save_path is None:
+        plt.show()
+    else:
+        plt.savefig(save_path, dpi=150, bbox_inches="tight")
+        plt.close()
+
+OPTIMIZERS = {
+    "sgd": "sgd_update",
+    "momentum": "momentum_update",
+    "adam": "adam_update",
+    "adamw": "adam_update",
+}
+
+# per epoch learning rate: fixed, cut to a tenth at 1/2 and 3/4 of the epochs, or cosine annealed to 0
+LR_SCHEDULES = ["constant", "step", "cosine"]
+
+# what a Dense layer can apply to x @ weights + bias, linear is the output layer's
+ACTIVATIONS = ["leaky_relu", "relu", "tanh", "linear"]
+
+# leaky_relu's slope below zero
+LEAKY_SLOPE = 0.01
+
+# adam's moment decay rates and the epsilon added to its denominator
+ADAM_BETAS = (0.9, 0.999)
+ADAM_EPS = 1e-8
+
+# rows per forward pass in predict and score_csv, about 8MB of first layer activations at float32
+PREDICT_CHUNK = 1 << 14
+
+# rows per csv read when building the feature cache, and per block of fit_scaler's pass
+CHUNK_ROWS = 1 << 16
+
+# contiguous rows per read when training with shuffle_buffer, see stream_batches
+STREAM_BLOCK = 4096
+
+# seconds DataParallel waits for its workers on one batch before taking one to have died
+WORKER_TIMEOUT = 300
+
+# bump when FeaturePipeline changes in a way its config doesn't capture, so old caches are ignored
+FEATURE_VERSION = 2
+
+class FeaturePipeline:
+    """Raw csv rows -> model features, fit once and reused. fit() learns the values missing
+    numbers are imputed with, fit_scaler() the normalisation stats, and transform() then
+    builds the base, squared, cubed and pairwise interaction columns into one array."""
+
+    columns = ['carat', 'cut', 'color', 'clarity', 'depth', 'table', 'price', 'x', 'y', 'z']
+    impute_cols = ['carat', 'depth', 'table', 'price']
+    category_maps = {
+        'cut': {'Unknown': 0, 'Fair': 1, 'Good': 2, 'Very Good': 3, 'Premium': 4, 'Ideal': 5},
+        'color': {'Unknown': 0, 'J': 1, 'I': 2, 'H': 3, 'G': 4, 'F': 5, 'E': 6, 'D': 7},
+        'clarity': {'Unknown': 0, 'I1': 1, 'SI2': 2, 'SI1': 3, 'VS2': 4, 'VS1': 5,
+                    'VVS2': 6, 'VVS1': 7, 'IF': 8}
+    }
+
+    def __init__(self):
+        self.feature_cols = [c for c in self.columns if c != 'price']
+        self.impute_values = None
+        self.feat_mean = None
+        self.feat_std = None
+        self.price_mean = None
+        self.price_std = None
+        # log price range of the training rows, predictions are clipped to it
+        self.price_min = None
+        self.price_max = None
+
+    def config(self):
+        return {'version': FEATURE_VERSION, 'columns': self.columns, 'impute_cols': self.impute_cols,
+                'category_maps': self.category_maps}
+
+    @property
+    def n_features(self):
+        n = len(self.feature_cols)
+        return 3 * n + n * (n - 1) // 2
+
+    def layout(self, raw):
+        # rows straight from the csv have a price column, rows to predict on may not
+        names = self.columns if raw.shape[1] == len(self.columns) else self.feature_cols
+        return {name: i for i, name in enumerate(names)}
+
+    @staticmethod
+    def parse_numbers(col):
+        # blank and 'nan' cells come back as nan
+        return np.where((col == '') | (col == 'nan'), 'nan', col).astype(float)
+
+    def fit(self, raw):
+        self.fit_chunks([raw])
+        return self
+
+    def fit_chunks(self, chunks):
+        """fit() over an iterable of raw row chunks, so a csv never has to be read whole.
+        Returns the number of rows seen."""
+        sums, counts = {}, {}
+        n_rows = 0
+        for raw in chunks:
+            layout = self.layout(raw)
+            n_rows += len(raw)
+            for name in self.impute_cols:
+                if name in layout:
+                    values = self.parse_numbers(raw[:, layout[name]])
+                    sums[name] = sums.get(name, 0.0) + float(np.nansum(values))
+                    counts[name] = counts.get(name, 0) + int(np.count_nonzero(~np.isnan(values)))
+        self.impute_values = {name: sums[name] / counts[name] if counts[name] else float('nan') for name in sums}
+        return n_rows
+
+    def column(self, raw, layout, name):
+        if name in self.category_maps:
+            # one dict lookup per distinct value, unknown categories map to 0
+            uniques, inverse = np.unique(raw[:, layout[name]], return_inverse=True)
+            codes = np.array([self.category_maps[name].get(u, 0) for u in uniques], dtype=float)
+            return codes[inverse.ravel()]
+        values = self.parse_numbers(raw[:, layout[name]])
+        if name in self.impute_values:
+            values[np.isnan(values)] = self.impute_values[name]
+        return values
+
+    def check_fitted(self):
+        # impute_values only come from fit, or from a cache or saved model the net loaded
+        if self.impute_values is None:
+            raise ValueError("pipeline not fitted, call load_data or pipeline.fit first")
+
+    def transform(self, raw, out=None, dtype=np.float64):
+        """Returns (features, log prices) as dtype, prices is None for rows without a price column."""
+        self.check_fitted()
+        layout = self.layout(raw)
+        n_base = len(self.feature_cols)
+        if out is None:
+            out = np.empty((len(raw), self.n_features), dtype=dtype)
+
+        base = out[:, :n_base]
+        for i, name in enumerate(self.feature_cols):
+            base[:, i] = self.column(raw, layout, name)
+        np.square(base, out=out[:, n_base:2 * n_base])
+        np.power(base, 3, out=out[:, 2 * n_base:3 * n_base])
+        k = 3 * n_base
+        for i in range(n_base):
+            for j in range(i + 1, n_base):
+                np.multiply(base[:, i], base[:, j], out=out[:, k])
+                k += 1
+
+        prices = np.log1p(self.column(raw, layout, 'price')).astype(out.dtype) if 'price' in layout else None
+        return out, prices
+
+    def fit_transform(self, raw, dtype=np.float64):
+        return self.fit(raw).transform(raw, dtype=dtype)
+
+    def fit_scaler(self, features, prices, blocks=None, rows=None):
+        """Fits the normalisation stats on the (start, stop) row blocks given, or on the row
+        indices rows, CHUNK_ROWS of them at a time, all rows by default. Only one block is
+        read at a time, so features can be a memmap bigger than memory. Stats are accumulated
+        in float64 and stored in the data's dtype, so scaling a float32 matrix stays float32."""
+        if rows is not None:
+            keys = [rows[start:start + CHUNK_ROWS] for start in range(0, len(rows), CHUNK_ROWS)]
+        else:
+            if blocks is None:
+                blocks = [(start, min(start + CHUNK_ROWS, len(features))) for start in range(0, len(features), CHUNK_ROWS)]
+            keys = [slice(start, stop) for start, stop in blocks]
+        dtype = features.dtype
+        feat_mean, feat_std = self.block_stats(features, keys)
+        price_mean, price_std = self.block_stats(prices, keys)
+        self.feat_mean = feat_mean.astype(dtype)
+        self.feat_std = feat_std.astype(dtype)
+        self.price_mean = dtype.type(price_mean)
+        self.price_std = dtype.type(price_std)
+        self.price_min = dtype.type(min(np.nanmin(prices[key]) for key in keys))
+        self.price_max = dtype.type(max(np.nanmax(prices[key]) for key in keys))
+
+    @staticmethod
+    def block_stats(data, keys):
+        # per column mean and std over data[key] for each key (a slice or row indices),
+        # block results merged with chan et al.'s pairwise update
+        n, mean, m2 = 0, 0.0, 0.0
+        for key in keys:
+            block = np.asarray(data[key], dtype=np.float64)
+            k = len(block)
+            block_mean = block.mean(axis=0)
+            block_m2 = ((block - block_mean) ** 2).sum(axis=0)
+            if n == 0:
+                mean, m2 = block_mean, block_m2
+            else:
+                delta = block_mean - mean
+                mean = mean + delta * (k / (n + k))
+                m2 = m2 + block_m2 + delta ** 2 * (n * k / (n + k))
+            n += k
+        return mean, np.sqrt(m2 / n)
+
+    def scale_features(self, features, out=None):
+        out = np.subtract(features, self.feat_mean, out=out)
+        out /= self.feat_std + 1e-8
+        return out
+
+    def scale_prices(self, prices, out=None):
+        out = np.subtract(prices, self.price_mean, out=out)
+        out /= self.price_std + 1e-8
+        return out
+
+    def unscale_prices(self, prices_norm):
+        # rows far outside the training data can extrapolate to log prices that expm1 turns
+        # into absurd or infinite dollar amounts, so they're held to the training range
+        prices = prices_norm * self.price_std + self.price_mean
+        return np.clip(prices, self.price_min, self.price_max, out=prices)
+
+class Dense:
+    """A fully connected layer, activation(x @ weights + bias), with inverted dropout on its
+    output while training. weights and bias, and their gradients grad_weights and grad_bias,
+    are views the owning Sequential sets up into its flat arrays."""
+
+    def __init__(self, n_in, n_out, activation="leaky_relu", dropout=0.0):
+        if activation not in ACTIVATIONS:
+            raise ValueError(f"Unknown activation '{activation}', choose from {ACTIVATIONS}")
+        if not 0 <= dropout < 1:
+            raise ValueError("dropout must be in [0, 1)")
+        self.n_in = n_in
+        self.n_out = n_out
+        self.activation = activation
+        self.dropout = dropout
+        self.weights = self.bias = None
+        self.grad_weights = self.grad_bias = None
+
+    @property
+    def shapes(self):
+        return [(self.n_in, self.n_out), (1, self.n_out)]
+
+    def workspace(self, n_rows, dtype):
+        # pre-activation z, activation a (z itself when linear), the loss gradient wrt the
+        # output then wrt z, plus what the activation's derivative and dropout need
+        z = np.empty((n_rows, self.n_out), dtype)
+        ws = {"z": z, "a": z if self.activation == "linear" else np.empty_like(z), "delta": np.empty_like(z)}
+        if self.activation in ("leaky_relu", "relu"):
+            ws["neg"] = np.empty(z.shape, dtype=bool)
+        elif self.activation == "tanh":
+            ws["slope"] = np.empty_like(z)
+        if self.dropout > 0:
+            ws["keep"] = np.empty_like(z)
+        return ws
+
+    def forward(self, x, ws=None, rng=None):
+        """The layer's output for x. Without ws it's a new array and there's no dropout, with
+        ws (training) everything is written into ws and the dropout mask is drawn from rng."""
+        if ws is None:
+            z = x @ self.weights
+            z += self.bias
+            a = z if self.activation == "linear" else np.empty_like(z)
+            self.activate(z, a)
+            return a
+        z, a = ws["z"], ws["a"]
+        np.matmul(x, self.weights, out=z)
+        z += self.bias
+        self.activate(z, a)
+        if self.dropout > 0:
+            # uniforms drawn straight into the mask buffer, then turned into 0 or 1 / (1 - rate)
+            keep = ws["keep"]
+            rng.random(out=keep, dtype=keep.dtype)
+            np.greater(keep, self.dropout, out=keep)
+            keep /= 1 - self.dropout
+            a *= keep
+        return a
+
+    def activate(self, z, out):
+        if self.activation == "leaky_relu":
+            # max(z, slope * z) is the leaky relu for slope < 1, written without temporaries
+            np.multiply(z, LEAKY_SLOPE, out=out)
+            np.maximum(z, out, out=out)
+        elif self.activation == "relu":
+            np.maximum(z, 0, out=out)
+        elif self.activation == "tanh":
+            np.tanh(z, out=out)
+
+    def backward(self, x, ws, prev_delta=None):
+        """Backprop from ws's delta, the loss gradient wrt this layer's output as left by the
+        forward pass on x, which is turned into the gradient wrt z in place. Writes the batch
+        mean gradients and, given prev_delta, the gradient wrt x into it."""
+        delta = ws["delta"]
+        if self.dropout > 0:
+            delta *= ws["keep"]
+        if self.activation == "leaky_relu":
+            np.less_equal(ws["z"], 0, out=ws["neg"])
+            np.multiply(delta, LEAKY_SLOPE, out=delta, where=ws["neg"])
+        elif self.activation == "relu":
+            np.less_equal(ws["z"], 0, out=ws["neg"])
+            np.copyto(delta, 0, where=ws["neg"])
+        elif self.activation == "tanh":
+            # 1 - tanh(z)^2, from z since a has had dropout applied
+            slope = ws["slope"]
+            np.tanh(ws["z"], out=slope)
+            np.square(slope, out=slope)
+            np.subtract(1, slope, out=slope)
+            delta *= slope
+
+        # batch means, so the step size doesn't grow with batch_size
+        np.matmul(x.T, delta, out=self.grad_weights)
+        self.grad_weights /= len(delta)
+        np.mean(delta, axis=0, keepdims=True, out=self.grad_bias)
+        if prev_delta is not None:
+            np.matmul(delta, self.weights.T, out=prev_delta)
+
+class Sequential:
+    """Dense layers applied in order. Every layer's weights and biases are views into one
+    flat array, params, and their gradients into another, grads, so an optimizer step is a
+    few whole array ops however deep the net is, and the weights copy, save and share as
+    one array."""
+
+    def __init__(self, layers, dtype=np.float32):
+        self.layers = list(layers)
+        self.dtype = np.dtype(dtype)
+        self.shapes = [shape for layer in self.layers for shape in layer.shapes]
+        n_params = sum(math.prod(shape) for shape in self.shapes)
+        self.grads = np.zeros(n_params, self.dtype)
+        views = split_flat(self.grads, self.shapes)
+        for layer, grad_weights, grad_bias in zip(self.layers, views[0::2], views[1::2]):
+            layer.grad_weights, layer.grad_bias = grad_weights, grad_bias
+        self.bind(np.zeros(n_params, self.dtype))
+        # training buffers per batch size, see workspace
+        self.workspaces = {}
+
+    def bind(self, params):
+        # makes the flat array params (e.g. a shared memory copy) the layers' weights
+        self.params = params
+        views = split_flat(params, self.shapes)
+        for layer, weights, bias in zip(self.layers, views[0::2], views[1::2]):
+            layer.weights, layer.bias = weights, bias
+
+    def init_weights(self, rng):
+        # he initialisation, drawn straight in the dtype, and zero biases
+        for layer in self.layers:
+            layer.weights[...] = rng.standard_normal(layer.weights.shape, dtype=self.dtype) * (2.0 / layer.n_in) ** 0.5
+            layer.bias[...] = 0
+
+    def weight_mask(self):
+        # 1 over the weights in params and 0 over the biases
+        mask = np.zeros_like(self.params)
+        for weights in split_flat(mask, self.shapes)[0::2]:
+            weights[...] = 1
+        return mask
+
+    def forward(self, x):
+        # inference, without dropout
+        for layer in self.layers:
+            x = layer.forward(x)
+        return x
+
+    def workspace(self, n_rows):
+        """Every array backprop writes to, allocated once per batch size."""
+        if n_rows not in self.workspaces:
+            self.workspaces[n_rows] = {
+                "layers": [layer.workspace(n_rows, self.dtype) for layer in self.layers],
+                "sq_error": np.empty((n_rows, self.layers[-1].n_out), self.dtype),
+            }
+        return self.workspaces[n_rows]
+
+    def backprop(self, X, y, rng):
+        """Forward and backward pass on a batch, with dropout masks drawn from rng, leaving
+        the batch mean gradients in grads. Returns the batch mse loss."""
+        ws = self.workspace(len(X))
+        layer_ws = ws["layers"]
+        inputs = [X]
+        for layer, lws in zip(self.layers, layer_ws):
+            inputs.append(layer.forward(inputs[-1], lws, rng))
+
+        # the output error is the loss gradient wrt the output, mse's factor 2 left out
+        error = layer_ws[-1]["delta"]
+        np.subtract(inputs[-1], y.reshape(len(X), -1), out=error)
+        sq_error = ws["sq_error"]
+        np.square(error, out=sq_error)
+        loss = float(sq_error.mean(dtype=np.float64))
+
+        for i in reversed(range(len(self.layers))):
+            self.layers[i].backward(inputs[i], layer_ws[i], layer_ws[i - 1]["delta"] if i else None)
+        return loss
+
 class DiamondPriceNet:
-    def __init__(self, hidden_size1=128, hidden_size2=64, hidden_size3=32, lr=1e-4, epochs=150, batch_size=1024, dropout_rate=0.2):
-        self.hidden_size1 = hidden_size1
-        self.hidden_size2 = hidden_size2
-        self.hidden_size3 = hidden_size3
+    """dtype sets the precision of the features, weights and every training buffer, float32
+    by default. Given the same weights, float32 predictions are within 1e-4 relative of
+    float64 ones (about 1e-6 on dataset.csv). The two dtypes draw different random streams,
+    so trained weights differ, but float32 final losses fall within the seed-to-seed spread
+    of float64 runs. All randomness comes from one np.random.Generator seeded with seed.
+
+    Gradients are batch means and the step comes from optimizer (see OPTIMIZERS), with lr
+    varied per epoch by lr_schedule. momentum only applies to "momentum" and weight_decay
+    only to "adamw", where it's decoupled and skips the biases. val_fraction > 0 holds out
+    that share of the rows and records val_loss_hist, training stops after patience epochs
+    without a better validation loss, and restore_best puts back the best epoch's weights.
+
+    shuffle_buffer=None trains in memory. Set to a number of rows, train streams the data
+    instead, for datasets bigger than memory: pass it load_data(..., shuffle=False)'s
+    memmaps and only about shuffle_buffer rows are held at once.
+
+    Batches are gathered on a background thread up to prefetch batches ahead of training
+    (0 gathers them in line, as does a single cpu where there's nothing to overlap with).
+    drop_last=False also trains on each epoch's last partial batch, which is otherwise
+    skipped.
+
+    n_workers > 1 splits every batch over that many processes, this one included, which
+    share the dataset and weights (see DataParallel). Dropout masks then come from a
+    stream per process, so results depend on n_workers but are reproducible for each.
+
+    The network is a Sequential of Dense layers, hidden_sizes wide (hidden_size1 to 3 when
+    not given) and then a linear output. activations is one name from ACTIVATIONS for every
+    hidden layer or a list with one per layer. dropout_rate is a list of rates per hidden
+    layer, or one rate applied to the first hidden layer only."""
+
+    def __init__(self, hidden_size1=128, hidden_size2=64, hidden_size3=32, lr=1e-3, epochs=150, batch_size=1024,
+                 dropout_rate=0.2, dtype=np.float32, seed=None, optimizer="adam", lr_schedule="constant",
+                 momentum=0.9, weight_decay=0.01, val_fraction=0.0, patience=None, restore_best=True,
+                 shuffle_buffer=None, prefetch=2, drop_last=True, n_workers=1, hidden_sizes=None,
+                 activations="leaky_relu"):
+        hidden_sizes = list(hidden_sizes) if hidden_sizes is not None else [hidden_size1, hidden_size2, hidden_size3]
+        activations = [activations] * len(hidden_sizes) if isinstance(activations, str) else list(activations)
+        if np.ndim(dropout_rate) == 0:
+            dropouts = [float(dropout_rate)] + [0.0] * (len(hidden_sizes) - 1)
+        else:
+            dropouts = [float(rate) for rate in dropout_rate]
+        if not hidden_sizes:
+            raise ValueError("hidden_sizes needs at least one layer")
+        if not len(activations) == len(dropouts) == len(hidden_sizes):
+            raise ValueError("activations and dropout_rate need one entry per hidden layer")
+        for activation in activations:
+            if activation not in ACTIVATIONS:
+                raise ValueError(f"Unknown activation '{activation}', choose from {ACTIVATIONS}")
+        if not all(0 <= rate < 1 for rate in dropouts):
+            raise ValueError("dropout_rate must be in [0, 1)")
+        if optimizer not in OPTIMIZERS:
+            raise ValueError(f"Unknown optimizer '{optimizer}', choose from {list(OPTIMIZERS)}")
+        if lr_schedule not in LR_SCHEDULES:
+            raise ValueError(f"Unknown lr_schedule '{lr_schedule}', choose from {LR_SCHEDULES}")
+        if not 0 <= val_fraction < 1:
+            raise ValueError("val_fraction must be in [0, 1)")
+        if patience is not None and val_fraction == 0:
+            raise ValueError("patience needs a validation split, set val_fraction")
+        if n_workers > 1 and shuffle_buffer is not None:
+            raise ValueError("n_workers > 1 trains from memory, it can't be combined with shuffle_buffer")
+        self.hidden_sizes = hidden_sizes
+        self.activations = activations
+        self.dropouts = dropouts
         self.lr = lr
         self.epochs = epochs
         self.batch_size = batch_size
         self.dropout_rate = dropout_rate
+        self.dtype = np.dtype(dtype)
+        self.rng = np.random.default_rng(seed)
+        # batch order draws from its own child stream, so a prefetch thread never shares a
+        # generator with the dropout draws and runs stay reproducible
+        self.data_rng = self.rng.spawn(1)[0]
+        self.optimizer = optimizer
+        self.lr_schedule = lr_schedule
+        self.momentum = momentum
+        self.weight_decay = weight_decay
+        self.val_fraction = val_fraction
+        self.patience = patience
+        self.restore_best = restore_best
+        self.shuffle_buffer = shuffle_buffer
+        self.prefetch = prefetch
+        self.drop_last = drop_last
+        self.n_workers = n_workers
         self.loss_hist = []
+        self.val_loss_hist = []
+        self.best_epoch = None
+        # the Sequential, built by init_network once the feature count is known
+        self.model = None
+        # optimizer buffers over the model's flat params and the step count, see init_optimizer
+        self.opt_state = {}
+        self.opt_steps = 0
+        self.pipeline = FeaturePipeline()
         
-    def load_data(self, filepath):
-        data = np.genfromtxt(filepath, delimiter=',', skip_header=1, dtype='str')
-        return self._process_data(data)
-    
-    def _process_data(self, data):
-        numeric_cols = [0, 4, 5, 6]
-        
-        for i in numeric_cols:
-            col = data[:, i].tolist() 
-            col = [np.nan if val in ['', 'nan'] else float(val) for val in col]
-            col = np.array(col)
-            mean_val = np.nanmean(col)
-            data[:, i] = np.where(np.isnan(col), mean_val, col)
-
-        mappings = {
-            'cut': {'Unknown': 0, 'Fair': 1, 'Good': 2, 'Very Good': 3, 'Premium': 4, 'Ideal': 5},
-            'color': {'Unknown': 0, 'J': 1, 'I': 2, 'H': 3, 'G': 4, 'F': 5, 'E': 6, 'D': 7},
-            'clarity': {'Unknown': 0, 'I1': 1, 'SI2': 2, 'SI1': 3, 'VS2': 4, 'VS1': 5, 
-                    'VVS2': 6, 'VVS1': 7, 'IF': 8}
-        }
-        
-        cat_cols = {'cut': 1, 'color': 2, 'clarity': 3}
-        for col_name, col_idx in cat_cols.items():
-            data[:, col_idx] = np.array([mappings[col_name].get(val, 0) for val in data[:, col_idx]])
+    def load_data(self, filepath, cache=True, cache_dir=None, shuffle=True):
+        """Returns the (features, log prices) arrays for a csv. The processed arrays are cached
+        as .npy files in cache_dir (default .feature_cache next to the csv), keyed on the csv's
+        contents and the preprocessing config, so later loads skip parsing and are memory
+        mapped. The cache is built CHUNK_ROWS csv rows at a time, so the csv never has to fit
+        in memory. shuffle=False returns the read-only memmaps as they are, without a copy,
+        which is what training with shuffle_buffer wants."""
+        if not cache:
+            features, prices = self.pipeline.fit_transform(self.read_csv(filepath), dtype=self.dtype)
+        else:
+            paths = self.cache_paths(filepath, cache_dir)
+            if not all(os.path.exists(path) for path in paths):
+                self.build_cache(filepath, paths)
+            features = np.load(paths[0], mmap_mode='r')
+            prices = np.load(paths[1], mmap_mode='r')
+            # the fitted imputation values come back with the arrays, for transforming new rows
+            self.pipeline.impute_values = dict(zip(self.pipeline.impute_cols, np.load(paths[2]).tolist()))
 
-        data = data.astype(float)
-        prices = data[:, 6]
-        features = np.delete(data, 6, axis=1)
-        
-        features_squared = features**2
-        features_cubed = features**3
-        
-        n_features = features.shape[1]
-        interactions = []
-        for i in range(n_features):
-            for j in range(i+1, n_features):
-                interactions.append(features[:, i] * features[:, j])
-        
-        features = np.hstack((features, features_squared, features_cubed, np.column_stack(interactions)))
-        
-        prices = np.log1p(prices)
-        
-        shuffle_idx = np.random.permutation(len(prices))
+        if not shuffle:
+            return features, prices
+        shuffle_idx = self.rng.permutation(len(prices))
         return features[shuffle_idx], prices[shuffle_idx]
 
-    def init_network(self, input_size):
-        self.weights1 = np.random.randn(input_size, self.hidden_size1) * np.sqrt(2.0/input_size)
-        self.bias1 = np.zeros((1, self.hidden_size1))
-        self.weights2 = np.random.randn(self.hidden_size1, self.hidden_size2) * np.sqrt(2.0/self.hidden_size1)
-        self.bias2 = np.zeros((1, self.hidden_size2))
-        self.weights3 = np.random.randn(self.hidden_size2, self.hidden_size3) * np.sqrt(2.0/self.hidden_size2)
-        self.bias3 = np.zeros((1, self.hidden_size3))
-        self.weights4 = np.random.randn(self.hidden_size3, 1) * np.sqrt(2.0/self.hidden_size3)
-        self.bias4 = np.zeros((1, 1))
-
-    def get_batches(self, X, y):
-        indices = np.random.permutation(len(X))
-        X, y = X[indices], y[indices]
-        n_batches = len(X) // self.batch_size
-        for i in range(n_batches):
-            start = i * self.batch_size
-            end = start + self.batch_size
-            yield X[start:end], y[start:end]
+    def build_cache(self, filepath, paths):
+        # two passes over the csv: the imputation means and row count, then each chunk is
+        # transformed straight into .npy files opened as writable memmaps
+        n_rows = self.pipeline.fit_chunks(self.read_csv_chunks(filepath))
+        # everything is written to temp files and renamed so a killed run can't leave half a
+        # cache, the pid keeps processes filling the same cache from sharing a temp file
+        tmp_paths = [f"{path}.{os.getpid()}.tmp" for path in paths]
+        features = np.lib.format.open_memmap(tmp_paths[0], mode='w+', dtype=self.dtype,
+                                             shape=(n_rows, self.pipeline.n_features))
+        prices = np.lib.format.open_memmap(tmp_paths[1], mode='w+', dtype=self.dtype, shape=(n_rows,))
+        start = 0
+        for raw in self.read_csv_chunks(filepath):
+            stop = start + len(raw)
+            _, chunk_prices = self.pipeline.transform(raw, out=features[start:stop])
+            prices[start:stop] = chunk_prices
+            start = stop
+        features.flush()
+        prices.flush()
+        del features, prices
+        with open(tmp_paths[2], 'wb') as f:
+            np.save(f, np.array([self.pipeline.impute_values[name] for name in self.pipeline.impute_cols]))
+        for tmp_path, path in zip(tmp_paths, paths):
+            os.replace(tmp_path, path)
 
     @staticmethod
-    def leaky_relu(x, alpha=0.01):
-        return np.where(x > 0, x, alpha * x)
+    def read_csv(filepath):
+        # loadtxt's C parser reads the same strings as genfromtxt in about a third of the time
+        return np.loadtxt(filepath, delimiter=',', skiprows=1, dtype=str, ndmin=2)
+
+    @staticmethod
+    def csv_line_chunks(f, chunk_size):
+        # lists of up to chunk_size lines from an open csv, without line endings. loadtxt
+        # skips blank lines, so they're dropped here too to keep rows lined up with lines
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines:
+                return
+            lines = [line.rstrip('\r\n') for line in lines if line.strip()]
+            if lines:
+                yield lines
+
+    @classmethod
+    def read_csv_chunks(cls, filepath, chunk_size=CHUNK_ROWS):
+        """read_csv, chunk_size rows at a time."""
+        with open(filepath) as f:
+            f.readline()
+            for lines in cls.csv_line_chunks(f, chunk_size):
+                yield np.loadtxt(lines, delimiter=',', dtype=str, ndmin=2)
+
+    def cache_key(self, filepath):
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        # one cache per dtype, so a float32 load is still a zero-copy memmap
+        digest.update(json.dumps({**self.pipeline.config(), 'dtype': self.dtype.name}, sort_keys=True).encode())
+        return digest.hexdigest()[:16]
+
+    def cache_paths(self, filepath, cache_dir=None):
+        filepath = Path(filepath)
+        cache_dir = Path(cache_dir) if cache_dir is not None else filepath.parent / '.feature_cache'
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"{filepath.stem}-{self.cache_key(filepath)}"
+        return tuple(str(cache_dir / f"{stem}-{part}.npy") for part in ('features', 'prices', 'impute'))
     
+    def build_model(self, input_size):
+        # the hidden layers, then a linear output for the log price. weights are all zero
+        sizes = [input_size, *self.hidden_sizes]
+        layers = [Dense(n_in, n_out, activation, dropout)
+                  for n_in, n_out, activation, dropout in zip(sizes, sizes[1:], self.activations, self.dropouts)]
+        layers.append(Dense(sizes[-1], 1, "linear"))
+        self.model = Sequential(layers, self.dtype)
+
+    def init_network(self, input_size):
+        self.build_model(input_size)
+        self.model.init_weights(self.rng)
+
+    def init_optimizer(self):
+        # velocity for momentum, first and second moments for adam, plus a scratch array so
+        # the updates don't allocate, all flat like the model's params
+        params = self.model.params
+        self.opt_state = {"scratch": np.empty_like(params)}
+        self.opt_steps = 0
+        if self.optimizer == "momentum":
+            self.opt_state["velocity"] = np.zeros_like(params)
+        elif self.optimizer in ("adam", "adamw"):
+            self.opt_state["m"] = np.zeros_like(params)
+            self.opt_state["v"] = np.zeros_like(params)
+        if self.optimizer == "adamw":
+            # the decay skips the biases
+            self.opt_state["decay_mask"] = self.model.weight_mask()
+
+    def scheduled_lr(self, epoch):
+        if self.lr_schedule == "step":
+            return self.lr * 0.1 ** ((epoch >= self.epochs // 2) + (epoch >= 3 * self.epochs // 4))
+        if self.lr_schedule == "cosine":
+            return self.lr * 0.5 * (1 + math.cos(math.pi * epoch / self.epochs))
+        return self.lr
+
+    # the updates below step the model's flat params from a flat gradient array, which
+    # they may overwrite
+
+    def sgd_update(self, params, grads, lr):
+        grads *= lr
+        params -= grads
+
+    def momentum_update(self, params, grads, lr):
+        velocity = self.opt_state["velocity"]
+        velocity *= self.momentum
+        velocity += grads
+        np.multiply(velocity, lr, out=grads)
+        params -= grads
+
+    def adam_update(self, params, grads, lr):
+        state = self.opt_state
+        m, v, scratch = state["m"], state["v"], state["scratch"]
+        beta1, beta2 = ADAM_BETAS
+        if self.optimizer == "adamw":
+            np.multiply(params, state["decay_mask"], out=scratch)
+            scratch *= lr * self.weight_decay
+            params -= scratch
+
+        np.square(grads, out=scratch)
+        scratch *= 1 - beta2
+        v *= beta2
+        v += scratch
+        grads *= 1 - beta1
+        m *= beta1
+        m += grads
+
+        # both bias corrections folded into the step size
+        step = lr * (1 - beta2 ** self.opt_steps) ** 0.5 / (1 - beta1 ** self.opt_steps)
+        np.sqrt(v, out=scratch)
+        scratch += ADAM_EPS
+        np.divide(m, scratch, out=scratch)
+        scratch *= step
+        params -= scratch
+
+    def get_batches(self, X, y, out=None):
+        """Shuffled batches of X and y, drawn by index so X is never copied whole. With out
+        each batch is gathered into buffers instead of new arrays: out is either one
+        (X_buf, y_buf) pair reused for every batch, or an iterator giving a pair per batch
+        (see background_batches). The last partial batch is skipped if drop_last."""
+        if isinstance(out, tuple):
+            out = itertools.repeat(out)
+        for batch in self.batch_indices(len(X)):
+            if out is None:
+                yield X[batch], y[batch]
+            else:
+                yield self.gather(X, y, batch, next(out))
+
+    def batch_indices(self, n_rows):
+        # row indices of each batch of a shuffled epoch over n_rows rows
+        indices = self.data_rng.permutation(n_rows)
+        stop = n_rows - n_rows % self.batch_size if self.drop_last else n_rows
+        for start in range(0, stop, self.batch_size):
+            yield indices[start:start + self.batch_size]
+
     @staticmethod
-    def leaky_relu_deriv(x, alpha=0.01):
-        return np.where(x > 0, 1, alpha)
+    def gather(X, y, rows, out):
+        # rows of X and y into the front of the buffer pair out, returned as views
+        X_buf, y_buf = out[0][:len(rows)], out[1][:len(rows)]
+        np.take(X, rows, axis=0, out=X_buf)
+        np.take(y, rows, axis=0, out=y_buf)
+        return X_buf, y_buf
 
-    def forward(self, x, training=True):
-        layer1 = self.leaky_relu(x @ self.weights1 + self.bias1)
-        if training:
-            layer1 *= (np.random.rand(*layer1.shape) > self.dropout_rate) / (1 - self.dropout_rate)
-        
-        layer2 = self.leaky_relu(layer1 @ self.weights2 + self.bias2)
-        layer3 = self.leaky_relu(layer2 @ self.weights3 + self.bias3)
-        output = layer3 @ self.weights4 + self.bias4
-        
-        return output, layer3, layer2, layer1
+    @staticmethod
+    def background_batches(make_batches, buffers):
+        """Runs make_batches(out) on a background thread and yields its batches, so the next
+        ones are gathered while the current one trains. out gives the producer a free pair
+        from buffers per batch, and a pair is only handed out again once the batch gathered
+        into it has been trained on."""
+        free, ready = queue.Queue(), queue.Queue()
+        for pair in buffers:
+            free.put(pair)
+        taken = collections.deque()
 
-    def train(self, features, prices, verbose=True):
-        self.feat_mean = features.mean(axis=0)
-        self.feat_std = features.std(axis=0)
-        self.price_mean = prices.mean()
-        self.price_std = prices.std()
-        
-        features_norm = (features - self.feat_mean) / (self.feat_std + 1e-8)
-        prices_norm = (prices - self.price_mean) / (self.price_std + 1e-8)
+        def out():
+            # a None in free means the consumer has stopped
+            for pair in iter(free.get, None):
+                taken.append(pair)
+                yield pair
+
+        def work():
+            try:
+                for batch in make_batches(out()):
+                    ready.put((taken.popleft(), batch))
+                ready.put(None)
+            except BaseException as e:  # raised again on the training thread
+                ready.put(e)
+
+        worker = threading.Thread(target=work, daemon=True)
+        worker.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                pair, batch = item
+                yield batch
+                free.put(pair)
+        finally:
+            free.put(None)
+            worker.join()
+
+    def forward(self, x):
+        # the output for already scaled features, without dropout
+        return self.model.forward(x)
+
+    def train_step(self, batch_X, batch_y, lr=None):
+        """One optimizer step on a batch at learning rate lr (self.lr if None), every
+        intermediate going into the model's workspace. Returns the batch loss."""
+        loss = self.model.backprop(batch_X, batch_y, self.rng)
+        self.apply_grads(self.model.grads, lr)
+        return loss
+
+    def apply_grads(self, grads, lr=None):
+        # one optimizer step from the flat gradient array grads (the model's, or
+        # DataParallel's reduced gradients), which the update may overwrite
+        self.opt_steps += 1
+        update = getattr(self, OPTIMIZERS[self.optimizer])
+        update(self.model.params, grads, self.lr if lr is None else lr)
+
+    def evaluate(self, features_norm, prices_norm):
+        # mse on already scaled data, without dropout
+        output = self.forward(features_norm)
+        return float(np.mean((output - prices_norm.reshape(-1, 1)) ** 2, dtype=np.float64))
+
+    def prepare_in_memory(self, features, prices):
+        # the whole scaled training set is held in memory and batches are drawn from it
+        # (by train, or by the DataParallel workers from a shared copy)
+        features = np.asarray(features, dtype=self.dtype)
+        prices = np.asarray(prices, dtype=self.dtype)
+        if self.val_fraction > 0:
+            # random held-out rows, the scaler is fitted on the training rows only
+            idx = self.rng.permutation(len(prices))
+            n_val = max(1, int(len(prices) * self.val_fraction))
+            val_features, val_prices = features[idx[:n_val]], prices[idx[:n_val]]
+            features, prices = features[idx[n_val:]], prices[idx[n_val:]]
+        self.pipeline.fit_scaler(features, prices)
+        features_norm = self.pipeline.scale_features(features)
+        prices_norm = self.pipeline.scale_prices(prices)
+        if self.val_fraction > 0:
+            val_features = self.pipeline.scale_features(val_features)
+            val_prices = self.pipeline.scale_prices(val_prices)
+
+        def val_loss():
+            return self.evaluate(val_features, val_prices)
+        return features_norm, prices_norm, val_loss if self.val_fraction > 0 else None
+
+    def prepare_streamed(self, features, prices):
+        # features and prices stay where they are (usually load_data's memmaps) and are only
+        # read STREAM_BLOCK contiguous rows at a time. held-out rows are whole blocks
+        blocks = [(start, min(start + STREAM_BLOCK, len(prices))) for start in range(0, len(prices), STREAM_BLOCK)]
+        order = self.rng.permutation(len(blocks))
+        n_val = max(1, round(len(blocks) * self.val_fraction)) if self.val_fraction > 0 else 0
+        if n_val >= len(blocks):
+            raise ValueError(f"Too few rows to hold out whole blocks of {STREAM_BLOCK}, lower val_fraction")
+        val_blocks = [blocks[i] for i in np.sort(order[:n_val])]
+        train_blocks = [blocks[i] for i in np.sort(order[n_val:])]
+        self.pipeline.fit_scaler(features, prices, blocks=train_blocks)
+
+        # a full shuffle buffer plus the block that filled it and a batch's worth of carry over
+        capacity = self.shuffle_buffer + STREAM_BLOCK + self.batch_size
+        buffers = np.empty((capacity, features.shape[1]), self.dtype), np.empty(capacity, self.dtype)
+
+        def batches(out):
+            return self.stream_batches(features, prices, train_blocks, buffers, out=out)
+
+        def val_loss():
+            return self.evaluate_blocks(features, prices, val_blocks, buffers)
+        return batches, val_loss if n_val else None
+
+    def load_block(self, features, prices, start, stop, buffers, at=0):
+        # rows start:stop copied into the buffers from row at on, cast and scaled in place
+        n = stop - start
+        X, y = buffers[0][at:at + n], buffers[1][at:at + n]
+        X[...] = features[start:stop]
+        y[...] = prices[start:stop]
+        self.pipeline.scale_features(X, out=X)
+        self.pipeline.scale_prices(y, out=y)
+        return X, y
+
+    def stream_batches(self, features, prices, blocks, buffers, out):
+        """Batches from row blocks read in a random order. Blocks are added to the buffers
+        until they hold shuffle_buffer rows, which are then shuffled and handed out as
+        batches, rows short of a full batch carry over to the next fill. out works as in
+        get_batches."""
+        if isinstance(out, tuple):
+            out = itertools.repeat(out)
+        X_buf, y_buf = buffers
+        n_held = 0
+        order = self.data_rng.permutation(len(blocks))
+        for k, b in enumerate(order):
+            start, stop = blocks[b]
+            self.load_block(features, prices, start, stop, buffers, at=n_held)
+            n_held += stop - start
+            if n_held < self.shuffle_buffer and k < len(order) - 1:
+                continue
+            rows = self.data_rng.permutation(n_held)
+            n_batches = n_held // self.batch_size
+            for i in range(n_batches):
+                yield self.gather(X_buf, y_buf, rows[i * self.batch_size:(i + 1) * self.batch_size], next(out))
+            rest = rows[n_batches * self.batch_size:]
+            X_buf[:len(rest)] = X_buf[rest]
+            y_buf[:len(rest)] = y_buf[rest]
+            n_held = len(rest)
+        if n_held and not self.drop_last:
+            yield self.gather(X_buf, y_buf, np.arange(n_held), next(out))
+
+    def evaluate_blocks(self, features, prices, blocks, buffers):
+        # evaluate over row blocks, streamed through the buffers like the training rows
+        total, count = 0.0, 0
+        for start, stop in blocks:
+            X, y = self.load_block(features, prices, start, stop, buffers)
+            output = self.forward(X)
+            total += float(np.sum((output - y.reshape(-1, 1)) ** 2, dtype=np.float64))
+            count += len(y)
+        return total / count
+
+    def prepare_indexed(self, features, prices, rows):
+        # only the given rows are trained on, gathered a batch at a time from features and
+        # prices where they are (e.g. a memmap shared by cross_validate's folds) and scaled
+        # in the batch buffers, so neither array is copied. held-out rows as in prepare_in_memory
+        rows = np.asarray(rows)
+        val_rows = None
+        if self.val_fraction > 0:
+            idx = self.rng.permutation(len(rows))
+            n_val = max(1, int(len(rows) * self.val_fraction))
+            val_rows, rows = rows[idx[:n_val]], rows[idx[n_val:]]
+        self.pipeline.fit_scaler(features, prices, rows=rows)
+
+        def batches(out):
+            if isinstance(out, tuple):
+                out = itertools.repeat(out)
+            for batch in self.batch_indices(len(rows)):
+                yield self.load_rows(features, prices, rows[batch], next(out))
+
+        if val_rows is None:
+            return batches, None
+        n_buffer = min(len(val_rows), PREDICT_CHUNK)
+        buffers = np.empty((n_buffer, features.shape[1]), self.dtype), np.empty(n_buffer, self.dtype)
+
+        def val_loss():
+            return self.evaluate_rows(features, prices, val_rows, buffers)
+        return batches, val_loss
+
+    def load_rows(self, features, prices, rows, buffers):
+        # load_block for row indices, gathered into the front of the buffers
+        X, y = self.gather(features, prices, rows, buffers)
+        self.pipeline.scale_features(X, out=X)
+        self.pipeline.scale_prices(y, out=y)
+        return X, y
+
+    def evaluate_rows(self, features, prices, rows, buffers):
+        # evaluate_blocks for row indices, a buffer's worth of rows at a time
+        total, count = 0.0, 0
+        n_buffer = len(buffers[1])
+        for start in range(0, len(rows), n_buffer):
+            X, y = self.load_rows(features, prices, rows[start:start + n_buffer], buffers)
+            output = self.forward(X)
+            total += float(np.sum((output - y.reshape(-1, 1)) ** 2, dtype=np.float64))
+            count += len(y)
+        return total / count
+
+    def train(self, features, prices, verbose=True, rows=None):
+        """Trains on features and prices as returned by load_data. With shuffle_buffer set
+        they're streamed (see prepare_streamed) instead of scaled into memory whole, with
+        n_workers > 1 the batches are split over processes (see DataParallel). Given row
+        indices rows, only those rows are trained on and batches are gathered from them in
+        place (see prepare_indexed), neither array is copied."""
+        if rows is not None:
+            if self.n_workers > 1:
+                raise ValueError("n_workers > 1 trains from memory, it can't be combined with rows")
+            batches, val_loss = self.prepare_indexed(features, prices, rows)
+        elif self.shuffle_buffer is None:
+            features_norm, prices_norm, val_loss = self.prepare_in_memory(features, prices)
+
+            def batches(out):
+                return self.get_batches(features_norm, prices_norm, out=out)
+        else:
+            batches, val_loss = self.prepare_streamed(features, prices)
         
         self.init_network(features.shape[1])
+        self.init_optimizer()
+        # one batch pair without prefetching, otherwise one being trained on, one being
+        # gathered and prefetch ready ones
+        prefetch = self.prefetch if (os.cpu_count() or 1) > 1 else 0
+        batch_buffers = [(np.empty((self.batch_size, features.shape[1]), self.dtype),
+                          np.empty(self.batch_size, self.dtype)) for _ in range(prefetch + 2 if prefetch else 1)]
+        self.loss_hist = []
+        self.val_loss_hist = []
+        self.best_epoch = None
+        best_loss = np.inf
+        best_params = None
+        epochs_since_best = 0
         
         if verbose:
             print("Starting training...")
         
-        for epoch in range(self.epochs):
-            epoch_loss = 0
-            batch_count = 0
-            
-            for batch_X, batch_y in self.get_batches(features_norm, prices_norm):
-                pred, layer3, layer2, layer1 = self.forward(batch_X)
-                error = pred - batch_y.reshape(-1, 1)
-
-                d_layer3 = error @ self.weights4.T
-                d_layer3 *= self.leaky_relu_deriv(layer3)
-                
-                d_layer2 = d_layer3 @ self.weights3.T
-                d_layer2 *= self.leaky_relu_deriv(layer2)
-                
-                d_layer1 = d_layer2 @ self.weights2.T
-                d_layer1 *= self.leaky_relu_deriv(layer1)
-                
-                self.weights4 -= self.lr * (layer3.T @ error)
-                self.bias4 -= self.lr * error.mean(axis=0, keepdims=True)
-                self.weights3 -= self.lr * (layer2.T @ d_layer3)
-                self.bias3 -= self.lr * d_layer3.mean(axis=0, keepdims=True)
-                self.weights2 -= self.lr * (layer1.T @ d_layer2)
-                self.bias2 -= self.lr * d_layer2.mean(axis=0, keepdims=True)
-                self.weights1 -= self.lr * (batch_X.T @ d_layer1)
-                self.bias1 -= self.lr * d_layer1.mean(axis=0, keepdims=True)
-                
-                epoch_loss += np.mean(error**2)
-                batch_count += 1
-            
-            avg_loss = epoch_loss / batch_count
-            self.loss_hist.append(avg_loss)
-            
-            if verbose and epoch % 10 == 0:
-                print(f"Epoch {epoch}: Loss = {avg_loss:.6f}")
-
-    def predict(self, features):
-        features_norm = (features - self.feat_mean) / (self.feat_std + 1e-8)
-        predictions, _, _, _ = self.forward(features_norm, training=False)
-        predictions = predictions * self.price_std + self.price_mean
-        return np.expm1(predictions)  
-
-    def plot_results(self, features, prices):
-        predictions = self.predict(features)
+        parallel = DataParallel(self, features_norm, prices_norm, self.n_workers) if self.n_workers > 1 else None
+        try:
+            for epoch in range(self.epochs):
+                lr = self.scheduled_lr(epoch)
+                if parallel is not None:
+                    epoch_loss, batch_count = parallel.run_epoch(lr)
+                else:
+                    epoch_loss, batch_count = self.run_epoch(batches, batch_buffers, prefetch, lr)
+
+                avg_loss = epoch_loss / batch_count
+                self.loss_hist.append(avg_loss)
+                if val_loss is None:
+                    if verbose and epoch % 10 == 0:
+                        print(f"Epoch {epoch}: Loss = {avg_loss:.6f}")
+                    continue
+
+                epoch_val_loss = val_loss()
+                self.val_loss_hist.append(epoch_val_loss)
+                if verbose and epoch % 10 == 0:
+                    print(f"Epoch {epoch}: Loss = {avg_loss:.6f}, Validation loss = {epoch_val_loss:.6f}")
+                # a nan loss never counts as an improvement, so a diverged run stops too
+                if epoch_val_loss < best_loss:
+                    best_loss = epoch_val_loss
+                    self.best_epoch = epoch
+                    epochs_since_best = 0
+                    if self.restore_best:
+                        if best_params is None:
+                            best_params = self.model.params.copy()
+                        else:
+                            np.copyto(best_params, self.model.params)
+                else:
+                    epochs_since_best += 1
+                    if self.patience is not None and epochs_since_best >= self.patience:
+                        if verbose:
+                            print(f"Stopping at epoch {epoch}, no improvement for {epochs_since_best} epochs")
+                        break
+        finally:
+            if parallel is not None:
+                parallel.close()
+
+        if best_params is not None:
+            np.copyto(self.model.params, best_params)
+            if verbose:
+                print(f"Restored weights from epoch {self.best_epoch} (validation loss {best_loss:.6f})")
+
+    def run_epoch(self, batches, buffers, prefetch, lr):
+        # one pass of batches(out) in this process, returns the summed batch losses and the batch count
+        if prefetch:
+            epoch_batches = self.background_batches(batches, buffers)
+        else:
+            epoch_batches = batches(buffers[0])
+        epoch_loss, batch_count = 0, 0
+        for batch_X, batch_y in epoch_batches:
+            epoch_loss += self.train_step(batch_X, batch_y, lr)
+            batch_count += 1
+        return epoch_loss, batch_count
+
+    def predict(self, features, chunk_size=PREDICT_CHUNK, rows=None):
+        # chunk_size rows per forward pass, so the activations stay small for any number of
+        # rows and a memmapped features array is only read a chunk at a time. given row
+        # indices rows, only those rows are predicted, gathered a chunk at a time
+        n_rows = len(features) if rows is None else len(rows)
+        predictions = np.empty((n_rows, 1), dtype=self.dtype)
+        for start in range(0, n_rows, chunk_size):
+            key = slice(start, start + chunk_size) if rows is None else rows[start:start + chunk_size]
+            chunk = np.asarray(features[key], dtype=self.dtype)
+            output = self.forward(self.pipeline.scale_features(chunk))
+            predictions[start:start + chunk_size] = np.expm1(self.pipeline.unscale_prices(output))
+        return predictions
+
+    def predict_rows(self, raw):
+        """Predicts prices for raw csv rows (strings, with or without the price column),
+        using the imputation values and scaling fitted when the net was trained."""
+        features, _ = self.pipeline.transform(np.atleast_2d(np.asarray(raw, dtype=str)), dtype=self.dtype)
+        return self.predict(features)
+
+    def score_csv(self, input_path, output_path, chunk_size=PREDICT_CHUNK):
+        """Copies a csv to output_path with a predicted_price column added, reading, scoring
+        and writing chunk_size rows at a time so memory doesn't grow with the file. Rows may
+        have the price column or not. Returns the number of rows scored."""
+        n_rows = 0
+        with open(input_path) as src, open(output_path, 'w') as dst:
+            dst.write(src.readline().rstrip('\r\n') + ',predicted_price\n')
+            for lines in self.csv_line_chunks(src, chunk_size):
+                predictions = self.predict_rows(np.loadtxt(lines, delimiter=',', dtype=str, ndmin=2))
+                dst.writelines(f"{line},{price:.2f}\n" for line, price in zip(lines, predictions.ravel()))
+                n_rows += len(lines)
+        return n_rows
+
+    def hyperparameters(self):
+        # constructor arguments, seed aside, that build an untrained copy of this net
+        names = ["hidden_sizes", "activations", "lr", "epochs", "batch_size", "dropout_rate", "optimizer",
+                 "lr_schedule", "momentum", "weight_decay", "val_fraction", "patience", "restore_best",
+                 "shuffle_buffer", "prefetch", "drop_last", "n_workers"]
+        return {"dtype": self.dtype.name, **{name: getattr(self, name) for name in names}}
+
+    def cross_validate(self, filepath, k=5, processes=None, cache_dir=None, verbose=True):
+        """k-fold cross-validation of this net's hyperparameters on a csv. The rows are split
+        into k random folds, and for each one a fresh net is trained on the other folds and
+        scored on it, the folds running in parallel in a pool of processes (default one per
+        fold, up to the cpu count). The features are built once into load_data's cache and
+        every fold memory maps those same files, training and predicting on its rows by index
+        without copying them. The cached features are imputed with means fitted on every row,
+        test folds included, so missing values leak a little of each test fold into its
+        training; the scaling is fitted per fold. Returns the per fold results plus the mean
+        and std over folds of the RMSE, MAE and median absolute error in dollars."""
+        if k < 2:
+            raise ValueError("k-fold cross-validation needs k >= 2")
+        _, prices = self.load_data(filepath, cache_dir=cache_dir, shuffle=False)
+        paths = self.cache_paths(filepath, cache_dir)[:2]
+        folds = np.array_split(self.rng.permutation(len(prices)), k)
+        # the pool runs the folds in parallel, so each fold trains in a single process
+        params = {**self.hyperparameters(), "n_workers": 1}
+        jobs = [(paths, np.sort(fold), params, rng) for fold, rng in zip(folds, self.rng.spawn(k))]
+        processes = processes or min(k, os.cpu_count() or 1)
+        if processes > 1:
+            with Pool(processes) as pool:
+                results = pool.map(_cross_validate_fold, jobs)
+        else:
+            results = [_cross_validate_fold(job) for job in jobs]
+
+        summary = {"folds": results}
+        for metric in ("rmse", "mae", "median_ae"):
+            values = np.array([fold[metric] for fold in results])
+            summary[metric] = float(values.mean())
+            summary[f"{metric}_std"] = float(values.std())
+        if verbose:
+            print(f"\n{k}-fold cross-validation")
+            print("Fold |    RMSE   |    MAE    | Median AE | Epochs")
+            print("-" * 52)
+            for i, fold in enumerate(results, 1):
+                print(f"{i:4d} | ${fold['rmse']:8.0f} | ${fold['mae']:8.0f} | ${fold['median_ae']:8.0f} | "
+                      f"{fold['epochs_run']:6d}")
+            for label, suffix in (("Mean", ""), (" Std", "_std")):
+                print(f"{label} | ${summary['rmse' + suffix]:8.0f} | ${summary['mae' + suffix]:8.0f} | "
+                      f"${summary['median_ae' + suffix]:8.0f} |")
+        return summary
+
+    def save(self, path):
+        """Writes the weights, the fitted imputation and scaling values and the layer sizes
+        and activations to one .npz file. .npz is added to path if missing, and the path
+        actually written is returned."""
+        pipeline = self.pipeline
+        pipeline.check_fitted()
+        path = os.fspath(path)
+        if not path.endswith('.npz'):
+            path += '.npz'
+        config = {'hidden_sizes': self.hidden_sizes, 'activations': self.activations,
+                  'dtype': self.dtype.name, 'pipeline': pipeline.config()}
+        np.savez(path, config=np.array(json.dumps(config)),
+                 impute=np.array([pipeline.impute_values[name] for name in pipeline.impute_cols]),
+                 feat_mean=pipeline.feat_mean, feat_std=pipeline.feat_std,
+                 price_stats=np.array([pipeline.price_mean, pipeline.price_std,
+                                       pipeline.price_min, pipeline.price_max]),
+                 params=self.model.params)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """A net saved by save(), ready for predict, predict_rows and score_csv."""
+        with np.load(path) as data:
+            config = json.loads(str(data['config']))
+            if config['pipeline'] != FeaturePipeline().config():
+                raise ValueError(f"{path} was saved with a different feature pipeline, retrain it")
+            net = cls(hidden_sizes=config['hidden_sizes'], activations=config['activations'], dtype=config['dtype'])
+            net.build_model(len(data['feat_mean']))
+            net.model.params[...] = data['params']
+            pipeline = net.pipeline
+            pipeline.impute_values = dict(zip(pipeline.impute_cols, data['impute'].tolist()))
+            pipeline.feat_mean, pipeline.feat_std = data['feat_mean'], data['feat_std']
+            pipeline.price_mean, pipeline.price_std, pipeline.price_min, pipeline.price_max = data['price_stats']
+        return net
+
+    def plot_results(self, features, prices, save_path=None, predictions=None):
+        if predictions is None:
+            predictions = self.predict(features)
         actual_prices = np.expm1(prices) 
         
+        plt = pyplot(headless=save_path is not None)
         plt.figure(figsize=(14.5, 11.6))  # Reduced by ~3% from (15, 12)
         
         plt.subplot(2, 1, 1)
@@ -168,7 +1103,10 @@ class DiamondPriceNet:
         plt.legend()
         
         plt.subplot(2, 2, 3)
-        plt.plot(self.loss_hist)
+        plt.plot(self.loss_hist, label="Training")
+        if self.val_loss_hist:
+            plt.plot(self.val_loss_hist, label="Validation")
+            plt.legend()
         plt.xlabel("Epoch")
         plt.ylabel("Loss")
         plt.title("Full Training Loss")
@@ -176,12 +1114,159 @@ class DiamondPriceNet:
         plt.subplot(2, 2, 4)
         start_epoch = 10 
         plt.plot(range(start_epoch, len(self.loss_hist)), self.loss_hist[start_epoch:])
+        if self.val_loss_hist:
+            plt.plot(range(start_epoch, len(self.val_loss_hist)), self.val_loss_hist[start_epoch:])
         plt.xlabel("Epoch")
         plt.ylabel("Loss")
         plt.title("Training Loss (Zoomed)")
         
         plt.tight_layout(pad=2.0)  # Added padding to ensure labels fit
-        plt.show()
+        show_or_save(plt, save_path)
+
+class DataParallel:
+    """Data parallel training for a DiamondPriceNet over n_procs processes, the calling one
+    included. The scaled training rows, the weights and a gradient slot per process live
+    in shared memory. For each batch the parent writes its row indices, every process
+    gathers and backprops its slice of them and writes the slice's gradients, weighted by
+    its share of the rows, to its slot. The parent then sums the slots into the batch mean
+    gradient and steps the optimizer on the shared weights, which the workers read next."""
+
+    def __init__(self, net, features, prices, n_procs):
+        self.net = net
+        self.n_procs = n_procs
+        self.blocks = []
+        model = net.model
+        # same order as the workers unpack them, see _data_parallel_worker
+        self.arrays = [
+            self.share(features), self.share(prices), self.share(model.params),
+            self.share(np.zeros((n_procs, len(model.params)), net.dtype)),
+            self.share(np.zeros(net.batch_size, dtype=np.int64)),
+            # rows in the current batch
+            self.share(np.zeros(1, dtype=np.int64)),
+            # summed squared error of each process's slice
+            self.share(np.zeros(n_procs)),
+        ]
+        # the net's weights become views of the shared copy, so every update reaches the workers
+        model.bind(self.arrays[2])
+        self.reduced = np.empty_like(model.params)
+        self.buffers = (np.empty((net.batch_size, features.shape[1]), net.dtype), np.empty(net.batch_size, net.dtype))
+
+        ctx = multiprocessing.get_context()
+        self.barrier = ctx.Barrier(n_procs)
+        config = {'hidden_sizes': net.hidden_sizes, 'activations': net.activations,
+                  'dropout_rate': net.dropouts, 'batch_size': net.batch_size, 'dtype': net.dtype.name}
+        specs = [(block.name, array.shape, array.dtype.str) for block, array in zip(self.blocks, self.arrays)]
+        self.workers = [ctx.Process(target=_data_parallel_worker, daemon=True,
+                                    args=(rank, n_procs, config, specs, self.barrier, rng))
+                        for rank, rng in enumerate(net.rng.spawn(n_procs - 1), 1)]
+        for worker in self.workers:
+            worker.start()
+
+    def share(self, array):
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.blocks.append(block)
+        shared = np.ndarray(array.shape, array.dtype, buffer=block.buf)
+        shared[...] = array
+        return shared
+
+    def run_epoch(self, lr):
+        # same interface as DiamondPriceNet.run_epoch
+        indices, control, losses = self.arrays[4], self.arrays[5], self.arrays[6]
+        epoch_loss, batch_count = 0, 0
+        for batch in self.net.batch_indices(len(self.arrays[1])):
+            indices[:len(batch)] = batch
+            control[0] = len(batch)
+            try:
+                self.barrier.wait(WORKER_TIMEOUT)
+                _backprop_slice(self.net, 0, self.n_procs, self.arrays, self.buffers)
+                self.barrier.wait(WORKER_TIMEOUT)
+            except threading.BrokenBarrierError:
+                raise RuntimeError("A data parallel worker process failed") from None
+            np.sum(self.arrays[3], axis=0, out=self.reduced)
+            self.net.apply_grads(self.reduced, lr)
+            epoch_loss += float(losses.sum()) / len(batch)
+            batch_count += 1
+        return epoch_loss, batch_count
+
+    def close(self):
+        # the net gets a private copy of its weights back before the shared memory goes
+        self.net.model.bind(self.net.model.params.copy())
+        # waiting workers get a BrokenBarrierError, which is their signal to exit
+        self.barrier.abort()
+        for worker in self.workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self.arrays = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+def split_flat(flat, shapes):
+    # consecutive views of a 1d array with the given shapes
+    views, offset = [], 0
+    for shape in shapes:
+        size = math.prod(shape)
+        views.append(flat[offset:offset + size].reshape(shape))
+        offset += size
+    return views
+
+def _backprop_slice(net, rank, n_procs, arrays, buffers):
+    # this process's share of the current batch, see DataParallel
+    features, prices, _, grads, indices, control, losses = arrays
+    n = int(control[0])
+    lo, hi = n * rank // n_procs, n * (rank + 1) // n_procs
+    if hi == lo:
+        grads[rank] = 0
+        losses[rank] = 0
+        return
+    batch_X, batch_y = net.gather(features, prices, indices[lo:hi], buffers)
+    losses[rank] = net.model.backprop(batch_X, batch_y, net.rng) * (hi - lo)
+    np.multiply(net.model.grads, (hi - lo) / n, out=grads[rank])
+
+def _data_parallel_worker(rank, n_procs, config, specs, barrier, rng):
+    # module level so any multiprocessing start method can run it
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    arrays = [np.ndarray(shape, dtype, buffer=block.buf) for block, (_, shape, dtype) in zip(blocks, specs)]
+    net = DiamondPriceNet(**config)
+    net.rng = rng
+    net.build_model(arrays[0].shape[1])
+    net.model.bind(arrays[2])
+    buffers = (np.empty((net.batch_size, arrays[0].shape[1]), net.dtype), np.empty(net.batch_size, net.dtype))
+    try:
+        while True:
+            barrier.wait()
+            _backprop_slice(net, rank, n_procs, arrays, buffers)
+            barrier.wait()
+    except threading.BrokenBarrierError:
+        pass  # DataParallel.close
+    except BaseException:
+        # wakes the parent rather than leaving it waiting on this worker
+        barrier.abort()
+        raise
+    finally:
+        # views of the blocks have to go before the blocks can close
+        del arrays, net
+        for block in blocks:
+            block.close()
+
+def _cross_validate_fold(args):
+    # module level so the pool can pickle it, the cached arrays are opened here rather
+    # than pickled over
+    paths, test_rows, params, rng = args
+    features = np.load(paths[0], mmap_mode='r')
+    prices = np.load(paths[1], mmap_mode='r')
+    train_mask = np.ones(len(prices), dtype=bool)
+    train_mask[test_rows] = False
+    train_rows = np.flatnonzero(train_mask)
+
+    net = DiamondPriceNet(seed=rng, **params)
+    net.train(features, prices, verbose=False, rows=train_rows)
+    predictions = net.predict(features, rows=test_rows).ravel().astype(np.float64)
+    error = predictions - np.expm1(prices[test_rows].astype(np.float64))
+    return {"rmse": float(np.sqrt(np.mean(error ** 2))), "mae": float(np.mean(np.abs(error))),
+            "median_ae": float(np.median(np.abs(error))), "epochs_run": len(net.loss_hist),
+            "train_rows": len(train_rows), "test_rows": len(test_rows)}
 
 def run_network():
     filepath = Path('M33174_CWK_Data_set.csv').resolve()
@@ -190,41 +1275,23 @@ def run_network():
         print("\nQuestion 4")
         print("=" * 35)
         try:
-            hidden1 = int(input("First hidden layer size (default 128): ") or 128)
-            hidden2 = int(input("Second hidden layer size (default 64): ") or 64)
-            hidden3 = int(input("Third hidden layer size (default 32): ") or 32)
-            lr = float(input("Learning rate (default 0.0001): ") or 0.0001)
-            epochs = int(input("Number of epochs (default 150): ") or 150)
-            batch_size = int(input("Batch size (default 1024): ") or 1024)
-            dropout = float(input("Dropout rate (default 0.2): ") or 0.2)
-
-            print(f"\nTraining network with:")
-            print(f"Hidden layer sizes: {hidden1}, {hidden2}, {hidden3}")
-            print(f"Learning rate: {lr}")
-            print(f"Epochs: {epochs}")
-            print(f"Batch size: {batch_size}")
-            print(f"Dropout rate: {dropout}")
-
-            net = DiamondPriceNet(
-                hidden_size1=hidden1,
-                hidden_size2=hidden2,
-                hidden_size3=hidden3,
-                lr=lr,
-                epochs=epochs,
-                batch_size=batch_size,
-                dropout_rate=dropout
-            )
-
-            features, prices = net.load_data(filepath)
-            net.train(features, prices)
-            net.plot_results(features, prices)
-
-            indices = np.random.choice(len(prices), 5)
+            model_path = input("Saved model to load (blank to train a new one): ").strip()
+            if model_path:
+                net = DiamondPriceNet.load(model_path)
+                # scored with the imputation values saved with the model, not refitted
+                features, prices = net.pipeline.transform(net.read_csv(filepath), dtype=net.dtype)
+                print(f"\nLoaded network with hidden layer sizes {', '.join(map(str, net.hidden_sizes))}")
+            else:
+                net, features, prices = train_network(filepath)
+
+            predictions = net.predict(features)
+            net.plot_results(features, prices, predictions=predictions)
+
+            indices = net.rng.choice(len(prices), 5)
             print("\nSample Predictions:")
             print("  Actual  | Predicted")
             print("-" * 25)
 
-            predictions = net.predict(features)
             actual_prices = np.expm1(prices)
 
             for idx in indices:
@@ -232,12 +1299,98 @@ def run_network():
                 predicted = predictions[idx][0]
                 print(f"${actual:7.0f} | ${predicted:7.0f}")
 
+            if not model_path:
+                # the plot and samples above are rows the net was trained on
+                folds = input("\nCross-validation folds for an unseen data check (blank to skip): ").strip()
+                if folds:
+                    net.cross_validate(filepath, k=int(folds))
+
+                save_path = input("\nSave model to (blank to skip): ").strip()
+                if save_path:
+                    print(f"Saved to {net.save(save_path)}")
+
             if input("\nTry again? (y/n): ").lower() != 'y':
                 break
 
         except ValueError:
             print("Invalid input. Please enter numerical values only.")
             continue
+        except OSError as e:
+            print(f"Could not use that file: {e}")
+            continue
+
+def train_network(filepath):
+    hidden1 = int(input("First hidden layer size (default 128): ") or 128)
+    hidden2 = int(input("Second hidden layer size (default 64): ") or 64)
+    hidden3 = int(input("Third hidden layer size (default 32): ") or 32)
+    optimizer = input("Optimizer, sgd/momentum/adam/adamw (default adam): ").strip().lower() or "adam"
+    lr = float(input("Learning rate (default 0.001): ") or 0.001)
+    epochs = int(input("Number of epochs (default 150): ") or 150)
+    batch_size = int(input("Batch size (default 1024): ") or 1024)
+    dropout = float(input("Dropout rate (default 0.2): ") or 0.2)
+
+    print(f"\nTraining network with:")
+    print(f"Hidden layer sizes: {hidden1}, {hidden2}, {hidden3}")
+    print(f"Optimizer: {optimizer}")
+    print(f"Learning rate: {lr}")
+    print(f"Epochs: {epochs}")
+    print(f"Batch size: {batch_size}")
+    print(f"Dropout rate: {dropout}")
+
+    net = DiamondPriceNet(
+        hidden_size1=hidden1,
+        hidden_size2=hidden2,
+        hidden_size3=hidden3,
+        lr=lr,
+        epochs=epochs,
+        optimizer=optimizer,
+        batch_size=batch_size,
+        dropout_rate=dropout
+    )
+
+    features, prices = net.load_data(filepath)
+    net.train(features, prices)
+    return net, features, prices
+
+def main(argv):
+    """python Q4.py score MODEL INPUT OUTPUT [--chunk-size N] scores a csv of any size with a
+    model saved from run_network or DiamondPriceNet.save. python Q4.py cv DATA [--folds K]
+    cross-validates a net on a csv. With no arguments the interactive run_network starts."""
+    parser = argparse.ArgumentParser(prog="Q4.py", description="Batch scoring and cross-validation for DiamondPriceNet")
+    commands = parser.add_subparsers(dest="command", required=True)
+    score = commands.add_parser("score", help="append a predicted_price column to a csv")
+    score.add_argument("model", help=".npz file written by DiamondPriceNet.save")
+    score.add_argument("input", help="csv with the dataset's columns, price optional")
+    score.add_argument("output")
+    score.add_argument("--chunk-size", type=int, default=PREDICT_CHUNK, help="rows held in memory at once")
+    cv = commands.add_parser("cv", help="k-fold cross-validation, errors in dollars")
+    cv.add_argument("data", help="csv with the dataset's columns")
+    cv.add_argument("--folds", type=int, default=5)
+    cv.add_argument("--processes", type=int, help="folds trained at once (default one per fold, up to the cpu count)")
+    cv.add_argument("--seed", type=int)
+    cv.add_argument("--hidden-sizes", default="128,64,32",
+                    help="comma separated hidden layer widths, any number of layers")
+    cv.add_argument("--epochs", type=int, default=150)
+    cv.add_argument("--lr", type=float, default=1e-3)
+    cv.add_argument("--optimizer", default="adam", choices=list(OPTIMIZERS))
+    cv.add_argument("--batch-size", type=int, default=1024)
+    cv.add_argument("--val-fraction", type=float, default=0.0, help="held out of each fold's training rows")
+    cv.add_argument("--patience", type=int, help="early stopping, needs --val-fraction")
+    args = parser.parse_args(argv)
+
+    if args.command == "score":
+        net = DiamondPriceNet.load(args.model)
+        n_rows = net.score_csv(args.input, args.output, chunk_size=args.chunk_size)
+        print(f"Scored {n_rows} rows into {args.output}")
+    else:
+        hidden_sizes = [int(size) for size in args.hidden_sizes.split(",")]
+        net = DiamondPriceNet(hidden_sizes=hidden_sizes, epochs=args.epochs, lr=args.lr, optimizer=args.optimizer,
+                              batch_size=args.batch_size, val_fraction=args.val_fraction, patience=args.patience,
+                              seed=args.seed)
+        net.cross_validate(args.data, k=args.folds, processes=args.processes)
 
 if __name__ == "__main__":
-    run_network()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        main(sys.argv[1:])
+    else:
+        run_network()
@@ -0,0 +1,235 @@
+"""Headless benchmarks for the four coursework programs.
+
+Runs GeneticAlgorithm.run (Q1), Question2.run_genetic_algorithm (Q2), NeuralNet.train (Q3)
+and DiamondPriceNet load_data/train/predict (Q4, loading both from the csv and from the
+feature cache, and training both in memory and streamed from the cache) over a grid of sizes with fixed seeds.
+Every case runs in a fresh process so its peak memory isn't mixed up with earlier cases.
+Results go to a json file that can be passed back in with --compare to diff two commits.
+
+    python bench.py                      # full grid, writes bench_results.json
+    python bench.py --quick --only q1,q2
+    python bench.py --output new.json --compare bench_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on windows, peak memory is reported as None there
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATASET = os.path.join(HERE, "dataset.csv")
+
+FULL_GRID = {
+    "q1": [dict(engine=engine, pop_size=pop_size, gens=50)
+           for engine in ("GeneticAlgorithm", "VectorizedGeneticAlgorithm")
+           for pop_size in (100, 1000, 10000)],
+    "q2": [dict(n_items=n_items, pop_size=pop_size, gens=30)
+           for n_items in (10, 1000, 20000)
+           for pop_size in (100, 1000)],
+    "q3": [dict(hidden_size=hidden_size, epochs=2000) for hidden_size in (32, 128)],
+    "q4": [dict(n_rows=n_rows, epochs=5, batch_size=1024, dtype=dtype)
+           for n_rows in (10000, None) for dtype in ("float32", "float64")]
+          + [dict(n_rows=None, epochs=5, batch_size=4096, dtype="float32", n_workers=n_workers)
+             for n_workers in (1, 4, 8)],
+}
+
+QUICK_GRID = {
+    "q1": [dict(engine=engine, pop_size=pop_size, gens=20)
+           for engine in ("GeneticAlgorithm", "VectorizedGeneticAlgorithm")
+           for pop_size in (100, 1000)],
+    "q2": [dict(n_items=n_items, pop_size=100, gens=20) for n_items in (10, 1000)],
+    "q3": [dict(hidden_size=32, epochs=500)],
+    "q4": [dict(n_rows=10000, epochs=2, batch_size=1024, dtype="float32")],
+}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def bench_q1(params, seed):
+    import Q1
+    ga = getattr(Q1, params["engine"])(params["pop_size"], params["gens"], 0.05, seed=seed)
+    base_mem = peak_rss_mb()
+    wall, (_, score) = timed(lambda: ga.run(verbose=False))
+    return [dict(stage="run", wall_s=wall, throughput=params["gens"] / wall, unit="gens/s",
+                 score=score, base_rss_mb=base_mem)]
+
+
+def bench_q2(params, seed):
+    from Q2 import Question2
+    rng = np.random.default_rng(seed)
+    items = np.column_stack([rng.integers(1, 100, params["n_items"]), rng.integers(1, 100, params["n_items"])])
+    limit = int(items[:, 0].sum() // 2)
+    ga = Question2(items, limit, params["pop_size"], params["gens"], 0.05, seed=seed)
+    base_mem = peak_rss_mb()
+    wall, (_, score) = timed(lambda: ga.run_genetic_algorithm(verbose=False))
+    return [dict(stage="run", wall_s=wall, throughput=params["gens"] / wall, unit="gens/s",
+                 score=score, base_rss_mb=base_mem)]
+
+
+def bench_q3(params, seed):
+    from Q3 import NeuralNet
+    np.random.seed(seed)
+    net = NeuralNet(hidden_size=params["hidden_size"], lr=0.001, epochs=params["epochs"])
+    n_samples = len(net.make_data()[0])
+    base_mem = peak_rss_mb()
+    wall, _ = timed(lambda: net.train(verbose=False))
+    return [dict(stage="train", wall_s=wall, throughput=params["epochs"] * n_samples / wall, unit="samples/s",
+                 score=float(net.loss_hist[-1]), base_rss_mb=base_mem)]
+
+
+def bench_q4(params, seed):
+    from Q4 import DiamondPriceNet
+    path = DATASET
+    if params["n_rows"] is not None:
+        # first n_rows of the dataset in a temp file so load_data sees a smaller csv
+        with open(DATASET) as src:
+            lines = [next(src) for _ in range(params["n_rows"] + 1)]
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, "w") as f:
+            f.writelines(lines)
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        net = DiamondPriceNet(epochs=params["epochs"], batch_size=params["batch_size"], dtype=params["dtype"],
+                              seed=seed, n_workers=params.get("n_workers", 1))
+        base_mem = peak_rss_mb()
+        load_wall, (features, prices) = timed(lambda: net.load_data(path, cache=False))
+        # first cached load parses and writes the cache, the timed one reads it back
+        net.load_data(path, cache_dir=cache_dir)
+        cached_wall, _ = timed(lambda: net.load_data(path, cache_dir=cache_dir))
+        train_wall, _ = timed(lambda: net.train(features, prices, verbose=False))
+        predict_wall, _ = timed(lambda: net.predict(features))
+        # the same training streamed from the cache's memmaps
+        stream_net = DiamondPriceNet(epochs=params["epochs"], batch_size=params["batch_size"], dtype=params["dtype"],
+                                     seed=seed, shuffle_buffer=65536)
+        stream_features, stream_prices = stream_net.load_data(path, cache_dir=cache_dir, shuffle=False)
+        stream_wall, _ = timed(lambda: stream_net.train(stream_features, stream_prices, verbose=False))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        if path != DATASET:
+            os.remove(path)
+
+    n = len(prices)
+    return [
+        dict(stage="load_data", wall_s=load_wall, throughput=n / load_wall, unit="samples/s", base_rss_mb=base_mem),
+        dict(stage="load_cached", wall_s=cached_wall, throughput=n / cached_wall, unit="samples/s",
+             base_rss_mb=base_mem),
+        dict(stage="train", wall_s=train_wall, throughput=params["epochs"] * n / train_wall, unit="samples/s",
+             score=float(net.loss_hist[-1]), base_rss_mb=base_mem),
+        dict(stage="train_stream", wall_s=stream_wall, throughput=params["epochs"] * n / stream_wall,
+             unit="samples/s", score=float(stream_net.loss_hist[-1]), base_rss_mb=base_mem),
+        dict(stage="predict", wall_s=predict_wall, throughput=n / predict_wall, unit="samples/s",
+             base_rss_mb=base_mem),
+    ]
+
+
+BENCHES = {"q1": bench_q1, "q2": bench_q2, "q3": bench_q3, "q4": bench_q4}
+
+
+def run_case(program, params, seed):
+    # runs inside a fresh worker process, see main
+    rows = BENCHES[program](params, seed)
+    peak = peak_rss_mb()
+    for row in rows:
+        row.update(program=program, params=params, seed=seed, peak_rss_mb=peak)
+    return rows
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def case_key(row):
+    return row["program"], json.dumps(row["params"], sort_keys=True), row["stage"]
+
+
+def print_table(rows, baseline=None):
+    old = {case_key(row): row for row in baseline or []}
+    print(f"\n{'program':8}{'stage':14}{'params':60}{'wall s':>9}{'throughput':>22}{'peak MB':>9}"
+          + (f"{'speedup':>9}" if baseline else ""))
+    print("-" * (122 + (9 if baseline else 0)))
+    for row in rows:
+        params = ", ".join(f"{k}={v}" for k, v in row["params"].items())
+        throughput = f"{row['throughput']:,.1f} {row['unit']}"
+        peak = f"{row['peak_rss_mb']:.0f}" if row["peak_rss_mb"] is not None else "-"
+        line = f"{row['program']:8}{row['stage']:14}{params:60}{row['wall_s']:9.3f}{throughput:>22}{peak:>9}"
+        if baseline:
+            prev = old.get(case_key(row))
+            line += f"{prev['wall_s'] / row['wall_s']:8.2f}x" if prev else f"{'new':>9}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="small grid for a fast smoke run")
+    parser.add_argument("--only", default="q1,q2,q3,q4", help="comma separated programs to run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results json to report speedups against")
+    args = parser.parse_args()
+
+    grid = QUICK_GRID if args.quick else FULL_GRID
+    programs = [p.strip().lower() for p in args.only.split(",") if p.strip()]
+    rows = []
+    for program in programs:
+        for params in grid[program]:
+            print(f"{program} {params}", flush=True)
+            # one process per case so ru_maxrss is the peak of that case alone
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                rows.extend(pool.submit(run_case, program, params, args.seed).result())
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.platform(),
+            "cpus": os.cpu_count(),
+            "grid": "quick" if args.quick else "full",
+            "seed": args.seed,
+        },
+        "results": rows,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_table(rows, baseline)
+    print(f"\nSaved {len(rows)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
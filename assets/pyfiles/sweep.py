@@ -0,0 +1,211 @@
+"""Headless hyperparameter sweeps for the four coursework programs.
+
+Takes a grid or random search space over the constructor parameters of GeneticAlgorithm
+(q1), Question2 (q2), NeuralNet (q3) or DiamondPriceNet (q4), runs the trials across a
+process pool with a seed per trial and writes every trial to one csv.
+
+Grid search, every combination of the listed values:
+    python sweep.py q1 pop_size=50,100,200 mut_rate=0.01,0.05,0.1 gens=200
+Random search, low:high draws uniformly (ints stay ints), add :log for log-uniform,
+comma lists are picked from at random:
+    python sweep.py q3 --random 40 hidden_size=16:256 lr=1e-4:1e-2:log epochs=5000
+    python sweep.py q4 --random 12 batch_size=256,512,1024 dropout_rate=0:0.5 epochs=50 dtype=float32
+    python sweep.py q4 optimizer=sgd,momentum,adam lr=1e-3,1e-2 val_fraction=0.1 patience=10
+
+q1 also takes engine=list,vectorized. q2 uses the built-in 10 item instance unless
+--items and --limit are given, q4 reads --data (defaults to dataset.csv next to this file).
+"""
+import argparse
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# the pool supplies the parallelism, so keep each trial's BLAS single threaded unless
+# the caller already set these
+for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(var, "1")
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# metrics each program is ranked by, in order of preference, and whether bigger is better. the
+# first one every successful trial has is used: q4 ranks by log-price validation loss when
+# every trial held rows out, else training loss. its dollar rmse and mae are only reported,
+# a handful of extrapolated rows can swing them by orders of magnitude
+OBJECTIVES = {"q1": (["best_score"], True), "q2": (["best_score"], True), "q3": (["loss"], False),
+              "q4": (["val_loss", "loss"], False)}
+
+
+def parse_value(text):
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    lowered = text.lower()
+    if lowered in ("true", "false"):
+        return lowered == "true"
+    if lowered == "none":
+        return None
+    return text
+
+
+def parse_space(specs):
+    """name=a,b,c gives a list of choices, name=low:high[:log] a range for random search."""
+    space = {}
+    for spec in specs:
+        name, sep, values = spec.partition("=")
+        if not sep or not values:
+            raise SystemExit(f"Bad parameter '{spec}', expected name=values")
+        parts = values.split(":")
+        if len(parts) in (2, 3) and "," not in values:
+            space[name] = ("range", parse_value(parts[0]), parse_value(parts[1]), parts[2:] == ["log"])
+        else:
+            space[name] = ("choice", [parse_value(v) for v in values.split(",")])
+    return space
+
+
+def grid_trials(space):
+    for name, spec in space.items():
+        if spec[0] == "range":
+            raise SystemExit(f"'{name}' is a range, ranges need --random")
+    names = list(space)
+    return [dict(zip(names, combo)) for combo in itertools.product(*(space[n][1] for n in names))]
+
+
+def random_trials(space, n_trials, rng):
+    trials = []
+    for _ in range(n_trials):
+        params = {}
+        for name, spec in space.items():
+            if spec[0] == "choice":
+                params[name] = spec[1][rng.integers(len(spec[1]))]
+                continue
+            _, low, high, log = spec
+            draw = np.exp(rng.uniform(np.log(low), np.log(high))) if log else rng.uniform(low, high)
+            params[name] = int(round(draw)) if isinstance(low, int) and isinstance(high, int) else float(draw)
+        trials.append(params)
+    return trials
+
+
+def trial_q1(params, seed, args):
+    from Q1 import GeneticAlgorithm, VectorizedGeneticAlgorithm
+    params = dict(params)
+    engine = VectorizedGeneticAlgorithm if params.pop("engine", "list") == "vectorized" else GeneticAlgorithm
+    ga = engine(seed=seed, **params)
+    best, score = ga.run(verbose=False)
+    return {"best_score": score, "final_avg": ga.avg_history[-1]}
+
+
+def trial_q2(params, seed, args):
+    from Q2 import Question2, DEFAULT_ITEMS, DEFAULT_LIMIT
+    items = Question2.load_items(args.items) if args.items else DEFAULT_ITEMS
+    limit = args.limit if args.limit is not None else DEFAULT_LIMIT
+    ga = Question2(items, limit, seed=seed, **params)
+    best, score = ga.run_genetic_algorithm(verbose=False)
+    return {"best_score": score, "final_avg": ga.avg_value_history[-1]}
+
+
+def trial_q3(params, seed, args):
+    from Q3 import NeuralNet
+    np.random.seed(seed)
+    net = NeuralNet(**params)
+    net.train(verbose=False)
+    return {"loss": float(net.loss_hist[-1])}
+
+
+def trial_q4(params, seed, args):
+    from Q4 import DiamondPriceNet
+    net = DiamondPriceNet(seed=seed, **params)
+    features, prices = net.load_data(args.data)
+    net.train(features, prices, verbose=False)
+    error = net.predict(features).ravel() - np.expm1(prices)
+    metrics = {"loss": float(net.loss_hist[-1]), "rmse": float(np.sqrt(np.mean(error**2))),
+               "mae": float(np.mean(np.abs(error))), "epochs_run": len(net.loss_hist)}
+    if net.val_loss_hist:
+        metrics.update(val_loss=min(net.val_loss_hist), best_epoch=net.best_epoch)
+    return metrics
+
+
+TRIALS = {"q1": trial_q1, "q2": trial_q2, "q3": trial_q3, "q4": trial_q4}
+
+
+def run_trial(program, trial_id, params, seed, args):
+    start = time.perf_counter()
+    try:
+        metrics = TRIALS[program](params, seed, args)
+        error = ""
+    except Exception as e:  # a bad combination shouldn't take the whole sweep down
+        metrics, error = {}, f"{type(e).__name__}: {e}"
+    return {"trial": trial_id, "seed": seed, **params, **metrics,
+            "wall_s": round(time.perf_counter() - start, 4), "error": error}
+
+
+def write_results(rows, path):
+    columns = []
+    for row in rows:
+        columns.extend(k for k in row if k not in columns)
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_top(rows, program, top, param_names):
+    metrics, higher_better = OBJECTIVES[program]
+    ok = [row for row in rows if not row["error"]]
+    metric = next((m for m in metrics if all(m in row for row in ok)), metrics[-1])
+    # diverged runs (nan or inf) go last whichever way the metric is ranked
+    ok.sort(key=lambda row: (not np.isfinite(row[metric]), -row[metric] if higher_better else row[metric]))
+    print(f"\nTop {min(top, len(ok))} of {len(rows)} trials by {metric}:")
+    for row in ok[:top]:
+        params = ", ".join(f"{k}={v}" for k, v in row.items() if k in param_names)
+        print(f"  trial {row['trial']:3d}  {metric}={row[metric]:.6g}  {params}  ({row['wall_s']:.2f}s)")
+    failed = len(rows) - len(ok)
+    if failed:
+        print(f"{failed} trials failed, see the error column")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument("program", choices=sorted(TRIALS))
+    parser.add_argument("params", nargs="+", help="name=a,b,c or name=low:high[:log]")
+    parser.add_argument("--random", type=int, metavar="N", help="random search with N trials instead of a grid")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0, help="base seed, each trial gets its own stream from it")
+    parser.add_argument("--output", default="sweep_results.csv")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--items", help="q2 items file (csv or .npy)")
+    parser.add_argument("--limit", type=float, help="q2 weight limit for --items")
+    parser.add_argument("--data", default=os.path.join(HERE, "dataset.csv"), help="q4 dataset csv")
+    args = parser.parse_args()
+
+    space = parse_space(args.params)
+    seeds = np.random.SeedSequence(args.seed)
+    if args.random:
+        trials = random_trials(space, args.random, np.random.default_rng(seeds.spawn(1)[0]))
+    else:
+        trials = grid_trials(space)
+    trial_seeds = [int(s.generate_state(1)[0]) for s in seeds.spawn(len(trials))]
+
+    print(f"Running {len(trials)} {args.program} trials on {args.workers} workers")
+    rows = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(run_trial, args.program, i, params, trial_seeds[i], args)
+                   for i, params in enumerate(trials)]
+        for done, future in enumerate(as_completed(futures), 1):
+            rows.append(future.result())
+            print(f"  {done}/{len(trials)} done", end="\r", flush=True)
+
+    rows.sort(key=lambda row: row["trial"])
+    write_results(rows, args.output)
+    print_top(rows, args.program, args.top, list(space))
+    print(f"\nSaved {len(rows)} trials to {args.output}")
+
+
+if __name__ == "__main__":
+    main()